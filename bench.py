@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+"""Benchmarks for every gas model.
+
+Each case is one model on one standard scenario and grid size, run in its
+own process (so the peak memory belongs to that case alone) with a fixed
+seed.  Reported per case: ticks/second, per tick latency percentiles and
+peak RSS.  Results are saved as JSON named after the current commit so two
+runs can be compared:
+
+  python bench.py                              all cases, saves bench-<commit>.json
+  python bench.py --models spindly --sizes 64,256 --ticks 20
+  python bench.py --compare bench-abc123.json bench-def456.json
+
+A case that raises is kept in the results with its error, and the run (or
+the comparison, if the new file has it) exits with 1 once everything else
+has been measured.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import gasprofile
+import headless
+
+# model name -> scenario options
+VARIANTS = {
+  'spindly': ('spindly', {}),
+  'spindly-vectorized': ('spindly', {'vectorized': True}),
+  'spindly-tiled-2': ('spindly', {'vectorized': True, 'workers': 2}),
+  'spindly-tiled': ('spindly', {'vectorized': True, 'workers': 4}),
+  'py_gass': ('py_gass', {}),
+  'py_gass2': ('py_gass2', {}),
+  'py_gass3': ('py_gass3', {}),
+  'py_gass_brady1': ('py_gass_brady1', {}),
+}
+
+SCENARIOS = ['point', 'many', 'maze']
+SIZES = [64, 128, 256, 512, 1024]
+
+
+def standard(name, size, seed=1):
+  """Gas and hard cell layout of a standard scenario on a size x size grid"""
+  rnd = random.Random(seed)
+  c = size // 2
+
+  if name == 'point':
+    return {'gas': [[c, c]], 'hard': []}
+
+  if name == 'many':
+    n = max(4, size // 16)
+    return {'gas': [[rnd.randrange(1, size - 1), rnd.randrange(1, size - 1)] for i in range(n)], 'hard': []}
+
+  if name == 'maze':
+    # walls every 8 cells both ways, each wall segment with a random gap
+    hard = []
+    for x in range(8, size, 8):
+      for y0 in range(0, size, 8):
+        gap = y0 + rnd.randrange(8)
+        hard += [[x, y] for y in range(y0, min(y0 + 8, size)) if y != gap]
+    for y in range(8, size, 8):
+      for x0 in range(0, size, 8):
+        gap = x0 + rnd.randrange(8)
+        hard += [[x, y] for x in range(x0, min(x0 + 8, size)) if x != gap and x % 8]
+    return {'gas': [[4, 4], [c + 4, c + 4]], 'hard': hard}
+
+  raise ValueError("unknown scenario %r" % name)
+
+
+def runCase(case):
+  """Run one case in this process and return its measurements"""
+  model, options = VARIANTS[case['variant']]
+  s = standard(case['scenario'], case['size'], case['seed'])
+  s.update({'model': model, 'width': case['size'], 'height': case['size'],
+            'seed': case['seed'], 'options': options})
+  s = headless.scenario(s)
+
+  module, gg, step = headless.build(s)
+  latencies = []
+  started = time.time()
+  with headless.Quiet():
+    for tick in range(case['ticks']):
+      t = time.time()
+      step()
+      latencies.append(time.time() - t)
+      if time.time() - started > case['maxSeconds']:
+        break
+
+  total = sum(latencies)
+  return {
+    'ticks': len(latencies),
+    'ticksPerSecond': round(len(latencies) / total, 3) if total > 0 else None,
+    'p50': gasprofile.percentile(latencies, 50),
+    'p90': gasprofile.percentile(latencies, 90),
+    'p99': gasprofile.percentile(latencies, 99),
+    'max': max(latencies),
+    # kilobytes on linux
+    'peakRss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'final': headless.metrics(gg),
+  }
+
+
+def spawn(case):
+  """Run a case in a child process, so each one gets a clean peak memory"""
+  p = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--case', json.dumps(case)],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  out, err = p.communicate()
+  if p.returncode != 0:
+    lines = err.decode('utf-8', 'replace').strip().split('\n')
+    return {'error': lines[-1]}
+  return json.loads(out.decode('utf-8').strip().split('\n')[-1])
+
+
+def commit():
+  try:
+    here = os.path.dirname(os.path.abspath(__file__))
+    out = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=here)
+    return out.decode('utf-8').strip()
+  except (OSError, subprocess.CalledProcessError):
+    return 'unknown'
+
+
+def compare(old, new, threshold=10.0):
+  """Print the ticks/s and median latency change of every case in both files"""
+  with open(old) as f:
+    a = json.load(f)
+  with open(new) as f:
+    b = json.load(f)
+
+  print("%s -> %s" % (a.get('commit'), b.get('commit')))
+  regressions = 0
+  for name in sorted(set(a['results']) & set(b['results'])):
+    ra = a['results'][name]
+    rb = b['results'][name]
+    if 'error' in ra or 'error' in rb:
+      print("%-40s %s" % (name, "ERROR " + rb['error'] if 'error' in rb else "fixed: was " + ra['error']))
+      if 'error' in rb:
+        regressions += 1
+      continue
+
+    change = 100.0 * (rb['ticksPerSecond'] - ra['ticksPerSecond']) / ra['ticksPerSecond']
+    flag = ""
+    if change < -threshold:
+      flag = "  REGRESSION"
+      regressions += 1
+    print("%-40s %10.1f -> %10.1f ticks/s %+7.1f%%   p50 %.4fs -> %.4fs   rss %dk -> %dk%s" % (
+      name, ra['ticksPerSecond'], rb['ticksPerSecond'], change,
+      ra['p50'], rb['p50'], ra['peakRss'], rb['peakRss'], flag))
+  return regressions
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark the gas models")
+  parser.add_argument('--models', default=",".join(sorted(VARIANTS)))
+  parser.add_argument('--scenarios', default=",".join(SCENARIOS))
+  parser.add_argument('--sizes', default=",".join(str(s) for s in SIZES))
+  parser.add_argument('--ticks', type=int, default=50)
+  parser.add_argument('--max-seconds', type=float, default=20.0, help="stop a case early after this long")
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--out', help="results file, default bench-<commit>.json")
+  parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+  parser.add_argument('--case', help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.case:
+    print(json.dumps(runCase(json.loads(args.case))))
+    return
+
+  if args.compare:
+    sys.exit(1 if compare(*args.compare) else 0)
+
+  results = {}
+  failed = []
+  for variant in args.models.split(','):
+    for scenario in args.scenarios.split(','):
+      for size in [int(s) for s in args.sizes.split(',')]:
+        name = "%s/%s/%d" % (variant, scenario, size)
+        case = {'variant': variant, 'scenario': scenario, 'size': size,
+                'seed': args.seed, 'ticks': args.ticks, 'maxSeconds': args.max_seconds}
+        r = spawn(case)
+        results[name] = r
+        if 'error' in r:
+          failed.append(name)
+          print("%-40s ERROR %s" % (name, r['error']))
+        else:
+          print("%-40s %10.1f ticks/s  p50 %.4fs  p90 %.4fs  p99 %.4fs  rss %dk  (%d ticks)" % (
+            name, r['ticksPerSecond'] or 0, r['p50'], r['p90'], r['p99'], r['peakRss'], r['ticks']))
+        sys.stdout.flush()
+
+  rev = commit()
+  out = args.out or "bench-%s.json" % rev
+  with open(out, 'w') as f:
+    json.dump({'commit': rev, 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+               'python': platform.python_version(), 'ticks': args.ticks,
+               'results': results}, f, indent=1, sort_keys=True)
+  print("saved " + out)
+  if failed:
+    print("%d of %d cases failed: %s" % (len(failed), len(results), ", ".join(failed)))
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
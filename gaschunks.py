@@ -0,0 +1,233 @@
+"""Sparse world storage for grids much bigger than the foam in them.
+
+A SparseGrid keeps its planes in chunks of SIZE x SIZE cells, made on the
+first write of something other than 0 and dropped again once every cell
+in them is EMPTY.  gg.types, gg.pressure and gg.heat are stand-ins indexed
+like the flat planes (i = y * w + x), reading 0 where there is no chunk, so
+cells, gg[x, y] and the GameGrid methods built on the planes work as they
+are.  What walks the whole grid (indicesOf, allCells, countOf, render) only
+visits the resident chunks, so the cost follows the occupied area.
+
+  class SparseGameGrid(gaschunks.SparseGrid, GameGrid):
+    pass
+  gg = SparseGameGrid(1 << 16, 1 << 16)
+
+The numpy paths (kernel, palette, files, recordings) need flat planes and
+check gg.dense.
+"""
+import array
+
+try:
+  import pygame
+except ImportError:
+  pygame = None
+
+import gasgrid
+
+SHIFT = 6
+SIZE = 1 << SHIFT
+MASK = SIZE - 1
+
+
+class Chunk(object):
+  __slots__ = ('planes', 'filled')
+
+  def __init__(self):
+    n = SIZE * SIZE
+    self.planes = (bytearray(n), array.array(gasgrid.PRESSURE, [0]) * n, array.array('h', [0]) * n)
+    # cells that are not EMPTY
+    self.filled = 0
+
+
+class ChunkPlane(object):
+  """One plane of a SparseGrid, indexed like a flat one"""
+
+  def __init__(self, grid, k):
+    self.grid = grid
+    self.k = k
+
+  def __len__(self):
+    return self.grid.w * self.grid.h
+
+  def __getitem__(self, i):
+    y, x = divmod(i, self.grid.w)
+    chunk = self.grid.chunks.get((x >> SHIFT, y >> SHIFT))
+    if chunk is None:
+      return 0
+    return chunk.planes[self.k][((y & MASK) << SHIFT) | (x & MASK)]
+
+  def __setitem__(self, i, value):
+    grid = self.grid
+    y, x = divmod(i, grid.w)
+    key = (x >> SHIFT, y >> SHIFT)
+    chunk = grid.chunks.get(key)
+    if chunk is None:
+      if not value:
+        return
+      chunk = grid.chunks[key] = Chunk()
+    plane = chunk.planes[self.k]
+    j = ((y & MASK) << SHIFT) | (x & MASK)
+    if self.k == 0:
+      chunk.filled += (value != gasgrid.EMPTY) - (plane[j] != gasgrid.EMPTY)
+    plane[j] = value
+
+  def __iter__(self):
+    """The values of the resident chunks, everything else is 0"""
+    for key, chunk in self.grid.resident():
+      for value in chunk.planes[self.k]:
+        yield value
+
+
+class SparseGrid(gasgrid.GameGrid):
+  dense = False
+  # the palette draws from flat planes
+  palette = None
+
+  def newPlanes(self, n):
+    # (chunk x, chunk y) -> Chunk
+    self.chunks = {}
+    self.emptyTile = None
+    return ChunkPlane(self, 0), ChunkPlane(self, 1), ChunkPlane(self, 2)
+
+  def resident(self):
+    """(key, chunk) of the chunks with something in them, in row order, dropping the rest"""
+    chunks = self.chunks
+    for key in [key for key, chunk in chunks.items() if not chunk.filled]:
+      del chunks[key]
+    return sorted(chunks.items(), key=lambda item: (item[0][1], item[0][0]))
+
+  def strips(self):
+    """Resident chunks by chunk row: [(cy, [(cx, chunk), ...]), ...]"""
+    strips = []
+    for (cx, cy), chunk in self.resident():
+      if not strips or strips[-1][0] != cy:
+        strips.append((cy, []))
+      strips[-1][1].append((cx, chunk))
+    return strips
+
+  def indicesOf(self, code):
+    """Plane indices of the resident cells with the given code, in row order"""
+    w = self.w
+    needle = bytearray([code])
+    for cy, strip in self.strips():
+      for r in range(min(SIZE, self.h - cy * SIZE)):
+        row = (cy * SIZE + r) * w
+        start = r * SIZE
+        end = start + SIZE
+        for cx, chunk in strip:
+          types = chunk.planes[0]
+          find = types.find
+          i = find(needle, start, end)
+          while i >= 0:
+            yield row + cx * SIZE + i - start
+            i = find(needle, i + 1, end)
+
+  def indicesIn(self, code, x0, y0, x1, y1):
+    w = self.w
+    x1 = min(x1, w)
+    needle = bytearray([code])
+    for y in range(y0, min(y1, self.h)):
+      row = (y & MASK) << SHIFT
+      for cx in range(x0 >> SHIFT, ((x1 - 1) >> SHIFT) + 1):
+        chunk = self.chunks.get((cx, y >> SHIFT))
+        if chunk is None:
+          continue
+        find = chunk.planes[0].find
+        left = row - cx * SIZE
+        end = left + min(x1, (cx + 1) * SIZE)
+        i = find(needle, left + max(x0, cx * SIZE), end)
+        while i >= 0:
+          yield y * w + i - left
+          i = find(needle, i + 1, end)
+
+  def allCells(self):
+    w = self.w
+    cellTypes = self.cellTypes
+    for (cx, cy), chunk in self.resident():
+      types = chunk.planes[0]
+      for j in range(SIZE * SIZE):
+        x = cx * SIZE + (j & MASK)
+        y = cy * SIZE + (j >> SHIFT)
+        if x < w and y < self.h:
+          yield cellTypes[types[j]].view(self, x, y, y * w + x)
+
+  def countOf(self, code):
+    if self.tally is not None:
+      return self.tally.counts[code]
+    needle = bytearray([code])
+    count = sum(chunk.planes[0].count(needle) for key, chunk in self.resident())
+    if code == gasgrid.EMPTY:
+      count += len(self.types) - SIZE * SIZE * len(self.chunks)
+    return count
+
+  def clone(self):
+    self.settle()
+    gg = self.__class__.__new__(self.__class__)
+    gg.__dict__.update(self.__dict__)
+    gg.types, gg.pressure, gg.heat = gg.newPlanes(0)
+    for key, chunk in self.resident():
+      copy = Chunk()
+      copy.planes = (bytearray(chunk.planes[0]), array.array(gasgrid.PRESSURE, chunk.planes[1]),
+                     array.array('h', chunk.planes[2]))
+      copy.filled = chunk.filled
+      gg.chunks[key] = copy
+    gg.frontier = None
+    gg.dirty = None
+    gg.tally = None
+    if self.tally is not None:
+      gg.trackTally()
+    gg.cooling = None
+    if self.cooling is not None:
+      gg.trackCooling(self.cooling.rate, self.cooling.events)
+    gg.regions = None
+    if self.regions is not None:
+      gg.trackRegions(self.regions.size, self.regions.idle)
+    return gg
+
+  def clear(self):
+    self.chunks.clear()
+    if self.frontier is not None:
+      self.frontier.reset()
+    self.retally()
+    self.dirty = None
+
+  def pendingCells(self):
+    if self.dirty is None:
+      return SIZE * SIZE * len(self.chunks)
+    return len(self.dirty)
+
+  def render(self, surface):
+    """Like GameGrid.render, a full render paints a ready made tile over the empty chunks"""
+    if self.dirty is not None:
+      return gasgrid.GameGrid.render(self, surface)
+
+    self.settle()
+    self.dirty = set()
+    cs = self.cellSize
+    width, height = surface.get_size()
+    area = pygame.Rect(0, 0, self.w * cs, self.h * cs).clip((0, 0, width, height))
+    surface.fill((0, 0, 0), area)
+
+    tile = self.tile(surface)
+    span = SIZE * cs
+    for cy in range(0, (area.height + span - 1) // span):
+      for cx in range(0, (area.width + span - 1) // span):
+        chunk = self.chunks.get((cx, cy))
+        if chunk is None or not chunk.filled:
+          surface.blit(tile, (cx * span, cy * span), (0, 0, area.width - cx * span, area.height - cy * span))
+    for cell in self.allCells():
+      if cell.x * cs < width and cell.y * cs < height:
+        self.renderCell(surface, cell)
+    return [area]
+
+  def tile(self, surface):
+    """A chunk of EMPTY cells, drawn once"""
+    if self.emptyTile is None:
+      cs = self.cellSize
+      tile = pygame.Surface((SIZE * cs, SIZE * cs), 0, surface)
+      tile.fill((0, 0, 0))
+      cls = self.cellTypes[gasgrid.EMPTY]
+      for j in range(SIZE * SIZE):
+        self.renderCell(tile, cls.view(self, j & MASK, j >> SHIFT, -1))
+      self.emptyTile = tile
+    return self.emptyTile
@@ -0,0 +1,103 @@
+"""Fixed timestep scheduling for the gas experiments.
+
+The main loops used to step the simulation once per rendered frame, so the
+gas moved as fast as the window could draw.  A Ticker is asked once per
+frame how many ticks are due and runs them, keeping the simulation at its
+own rate whatever the frame rate does.
+"""
+import collections
+import time
+
+
+class Ticker(object):
+  """Runs step() ticksPerSecond times a second, spread over the frames.
+
+  ticksPerSecond None means as fast as possible: every frame keeps ticking
+  until frameBudget seconds are used up, so rendering still gets a turn.
+  When ticks fall behind (a slow step or render) a frame runs at most
+  maxCatchUp of them, and stops early once it has used frameBudget, the
+  rest is dropped rather than piling up.
+  """
+
+  def __init__(self, step, ticksPerSecond=10, maxCatchUp=8, frameBudget=1.0 / 30):
+    self.step = step
+    self.ticksPerSecond = ticksPerSecond
+    self.maxCatchUp = maxCatchUp
+    self.frameBudget = frameBudget
+    self.clock = time.time
+    # the rate to go back to when leaving the as fast as possible mode
+    self.target = ticksPerSecond or 10
+    self.ticks = 0
+    self.owed = 0.0
+    self.last = None
+    # when the recent ticks ran, for the achieved rate
+    self.recent = collections.deque()
+
+  def fast(self):
+    return self.ticksPerSecond is None
+
+  def advance(self, enabled=True):
+    """Run the ticks that are due since the last call, returns how many ran"""
+    now = self.clock()
+    if not enabled or self.last is None:
+      self.last = now
+      self.owed = 0.0
+      return 0
+
+    ran = 0
+    if self.fast():
+      end = now + self.frameBudget
+      while True:
+        self.tick()
+        ran += 1
+        if self.clock() >= end:
+          break
+    else:
+      self.owed += (now - self.last) * self.ticksPerSecond
+      while self.owed >= 1.0:
+        if ran == self.maxCatchUp or (ran and self.clock() - now > self.frameBudget):
+          # can't keep up, drop what is owed instead of falling further behind
+          self.owed = 0.0
+          break
+        self.tick()
+        self.owed -= 1.0
+        ran += 1
+
+    self.last = now
+    return ran
+
+  def tick(self):
+    self.step()
+    self.ticks += 1
+    self.recent.append(self.clock())
+
+  def rate(self):
+    """Ticks per second achieved over the last second"""
+    recent = self.recent
+    if not recent:
+      return 0.0
+    now = self.clock()
+    while recent and recent[0] < now - 1.0:
+      recent.popleft()
+    return float(len(recent))
+
+  def faster(self):
+    if not self.fast():
+      self.ticksPerSecond = self.ticksPerSecond * 2
+
+  def slower(self):
+    if self.fast():
+      self.ticksPerSecond = self.target
+    elif self.ticksPerSecond > 1:
+      self.ticksPerSecond = self.ticksPerSecond // 2
+
+  def toggleFast(self):
+    if self.fast():
+      self.ticksPerSecond = self.target
+    else:
+      self.target = self.ticksPerSecond
+      self.ticksPerSecond = None
+
+  def describe(self):
+    target = "max" if self.fast() else str(self.ticksPerSecond)
+    return "Ticks/s: %d (target %s)" % (self.rate(), target)
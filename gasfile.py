@@ -0,0 +1,182 @@
+"""Save and load worlds.
+
+A file is a fixed header followed by the planes as they are in memory:
+
+  magic 'GASG', version, flags, model name (16 bytes), w, h, tick, seed
+  types      w * h bytes
+  pressure   w * h int64 (int32 in version 1 files)
+  heat       w * h int16
+
+all little endian.  With the ZLIB flag the planes are one zlib stream,
+otherwise the file is memory mapped copy on write and the pressure and heat
+planes of the grid become ctypes arrays over the mapping, so nothing is
+read until it is touched and edits never reach the file (the types are
+copied, the grid needs a bytearray).  The tick and seed are those of the grid's random numbers, so a loaded
+world goes on exactly as the saved one would have:
+
+  gasfile.save(gg, 'maze.gas')
+  gg = gasfile.load('maze.gas')          a new grid of the saved model
+  gasfile.load('maze.gas', gg)           or back into a grid of the same size
+"""
+import array
+import ctypes
+import importlib
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+import gasgrid
+
+MAGIC = b'GASG'
+VERSION = 2
+# flags
+ZLIB = 1
+
+HEADER = struct.Struct('<4sHH16sIIqQ')
+
+
+class Header(object):
+  def __init__(self, model, w, h, tick=0, seed=0, flags=0, version=VERSION):
+    self.model = model
+    self.w = w
+    self.h = h
+    self.tick = tick
+    self.seed = seed
+    self.flags = flags
+    self.version = version
+
+  def pack(self):
+    return HEADER.pack(MAGIC, self.version, self.flags, self.model.encode('ascii'),
+                       self.w, self.h, self.tick, self.seed)
+
+  @classmethod
+  def unpack(cls, data):
+    if len(data) < HEADER.size:
+      raise ValueError("not a gas world, too short")
+    magic, version, flags, model, w, h, tick, seed = HEADER.unpack(data[:HEADER.size])
+    if magic != MAGIC:
+      raise ValueError("not a gas world")
+    if version > VERSION:
+      raise ValueError("gas world version %d, this reads up to %d" % (version, VERSION))
+    return cls(model.rstrip(b'\0').decode('ascii'), w, h, tick, seed, flags, version)
+
+
+def little(plane):
+  """plane as little endian bytes, plane an array or a ctypes array"""
+  if not isinstance(plane, array.array):
+    mapped = plane
+    plane = array.array(mapped._type_._type_)
+    plane.fromstring(ctypes.string_at(ctypes.addressof(mapped), ctypes.sizeof(mapped)))
+  if sys.byteorder == 'big' and plane.itemsize > 1:
+    plane = array.array(plane.typecode, plane)
+    plane.byteswap()
+  return plane.tostring()
+
+
+def modelOf(gg):
+  """Module name of the grid's model, also when it was run as a script"""
+  model = gg.__class__.__module__
+  if model == '__main__':
+    model = os.path.splitext(os.path.basename(sys.modules['__main__'].__file__))[0]
+  return model
+
+
+def save(gg, path, model=None, compress=False):
+  """Write gg to path, model defaults to the module the grid class is in"""
+  if not gg.dense:
+    raise ValueError("only grids with flat planes can be saved")
+  gg.settle()
+  header = Header(model or modelOf(gg), gg.w, gg.h, gg.tick, gg.rng.seed,
+                  ZLIB if compress else 0)
+  planes = bytes(gg.types) + little(gg.pressure) + little(gg.heat)
+  if compress:
+    planes = zlib.compress(planes)
+  # written next to it and moved over, a grid loaded from path may still be
+  # mapping the old file
+  temporary = path + '.tmp'
+  with open(temporary, 'wb') as f:
+    f.write(header.pack())
+    f.write(planes)
+  if os.name == 'nt' and os.path.exists(path):
+    os.remove(path)
+  os.rename(temporary, path)
+
+
+def header(path):
+  with open(path, 'rb') as f:
+    return Header.unpack(f.read(HEADER.size))
+
+
+def grid(model, w, h):
+  """A new empty grid of the named model"""
+  module = importlib.import_module(model)
+  if getattr(module, 'sparse', False):
+    return module.SparseGameGrid(w, h)
+  return module.GameGrid(w, h)
+
+
+def load(path, gg=None):
+  """Read the world in path into gg, or into a new grid of its model, returns the grid"""
+  with open(path, 'rb') as f:
+    head = Header.unpack(f.read(HEADER.size))
+    if gg is None:
+      gg = grid(head.model, head.w, head.h)
+    elif not gg.dense:
+      raise ValueError("only grids with flat planes can be loaded into")
+    elif (gg.w, gg.h) != (head.w, head.h):
+      raise ValueError("world is %dx%d, the grid %dx%d" % (head.w, head.h, gg.w, gg.h))
+
+    if head.flags & ZLIB:
+      planes = zlib.decompress(f.read())
+      restore(gg, head, planes, 0)
+    else:
+      # stays open as long as the planes over it are around
+      planes = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+      restore(gg, head, planes, HEADER.size)
+  return gg
+
+
+def restore(gg, head, data, offset):
+  n = head.w * head.h
+  types = data[offset:offset + n]
+  offset += n
+  if isinstance(data, mmap.mmap) and head.version == VERSION and sys.byteorder == 'little':
+    if len(data) < offset + (ctypes.sizeof(ctypes.c_int64) + ctypes.sizeof(ctypes.c_int16)) * n:
+      raise ValueError("gas world is cut short")
+    pressure = (ctypes.c_int64 * n).from_buffer(data, offset)
+    heat = (ctypes.c_int16 * n).from_buffer(data, offset + ctypes.sizeof(pressure))
+    gg.types[:] = types
+    gg.pressure = pressure
+    gg.heat = heat
+    resume(gg, head)
+    return
+
+  pressure = array.array('i' if head.version == 1 else gasgrid.PRESSURE)
+  size = pressure.itemsize * n
+  pressure.fromstring(data[offset:offset + size])
+  offset += size
+  heat = array.array('h')
+  heat.fromstring(data[offset:offset + 2 * n])
+  if len(heat) != n:
+    raise ValueError("gas world is cut short")
+  if sys.byteorder == 'big':
+    pressure.byteswap()
+    heat.byteswap()
+
+  gg.types[:] = types
+  gg.pressure[:] = array.array(gasgrid.PRESSURE, pressure) if head.version == 1 else pressure
+  gg.heat[:] = heat
+  resume(gg, head)
+
+
+def resume(gg, head):
+  """Carry on from the tick and seed of head, with everything kept about the planes redone"""
+  gg.tick = head.tick
+  gg.reseed(head.seed)
+  if gg.frontier is not None:
+    # recomputed from the types, it does not depend on how they came about
+    gg.trackFrontier(gg.frontier.isActive)
+  gg.retally()
+  gg.dirty = None
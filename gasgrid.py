@@ -0,0 +1,1099 @@
+"""Array backed world storage shared by the gas experiments.
+
+The world is kept as parallel typed planes instead of one python object per
+cell:
+
+  types     bytearray, one cell type code per cell
+  pressure  array(PRESSURE), 64 bit
+  heat      array('h')
+
+pressure and heat can also be ctypes arrays of the same types, over shared
+memory (gasworker) or a mapped file (gasfile); copyPlane() copies between
+the two kinds.
+
+gg[x, y] hands out a small view object of the cell class registered for the
+type code at that position, so the event handlers and cell update code can
+keep using isinstance() and cell.pressure like before.  Placing a detached
+cell (gg[x, y] = GasCell()) copies its values into the planes and binds the
+cell to that position.
+
+A cell's grid and position are set once, by gg[x, y] or when the view is
+made, and are read only after that.  Reading the grid never writes to any
+object but the new view, so any number of readers can share it.
+
+trackTally() keeps counts, pressure and heat totals current as cells are
+written (Tally), so the overlays read them without walking the grid.
+
+trackCooling() works gas heat out from the tick it was set instead of
+counting it down every tick (Cooling), and trackRegions() lets the parts of
+the grid where nothing goes on sleep through the update (Regions).  Cooled
+heat reaches the heat plane when it is needed, gg.settle() does it for code
+that reads the planes whole.
+"""
+import array
+import collections
+import ctypes
+import heapq
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+import gasrandom
+
+# typecode of the pressure plane.  64 bit, py_gass2 piles pressure up well
+# past what 32 bits hold; array has 'q' from python 3.3, before that 'l' is
+# the 64 bit one (on 64 bit unix)
+try:
+  PRESSURE = array.array('q').typecode
+except ValueError:
+  PRESSURE = 'l'
+
+# pressure saturates at what the plane holds rather than wrapping or raising.
+# even 64 bits runs out, py_gass2 divides pressure out to its neighbors
+# without taking it from the source so it grows without bound on big grids
+PRESSURE_MAX = 2 ** (8 * array.array(PRESSURE).itemsize - 1) - 1
+PRESSURE_MIN = -PRESSURE_MAX - 1
+
+
+def saturate(pressure):
+  """pressure clamped to the range of the pressure plane"""
+  if pressure > PRESSURE_MAX:
+    return PRESSURE_MAX
+  if pressure < PRESSURE_MIN:
+    return PRESSURE_MIN
+  return pressure
+
+
+
+def address(plane):
+  """Something ctypes.memmove takes for a bytearray, array or ctypes array"""
+  if isinstance(plane, bytearray):
+    return (ctypes.c_char * len(plane)).from_buffer(plane)
+  if hasattr(plane, 'buffer_info'):
+    return plane.buffer_info()[0]
+  return plane
+
+
+def copyPlane(dest, src):
+  """dest[:] = src for two planes of the same type and size, array or ctypes array"""
+  if isinstance(src, ctypes.Array):
+    size = ctypes.sizeof(src)
+  else:
+    size = len(src) * getattr(src, 'itemsize', 1)
+  ctypes.memmove(address(dest), address(src), size)
+
+
+EMPTY = 0
+HARD = 1
+GAS = 2
+AMBER = 3
+
+# (dx, dy) of the 8 neighbors, in the order getNeighbors returns them
+NEIGHBORS = [(-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]
+
+
+def plane(name):
+  """Cell attribute that lives in the grid plane of the same name once placed"""
+  slot = '_' + name
+
+  def get(self):
+    if self._grid is None:
+      return getattr(self, slot, 0)
+    return getattr(self._grid, name)[self._i]
+
+  def getHeat(self):
+    gg = self._grid
+    if gg is None:
+      return getattr(self, slot, 0)
+    if gg.cooling is not None:
+      return gg.cooling.heat(self._i)
+    return gg.heat[self._i]
+
+  def set(self, value):
+    gg = self._grid
+    if gg is None:
+      setattr(self, slot, value)
+    elif name == 'types':
+      gg.setType(self._i, value)
+    elif name == 'pressure':
+      gg.setPressure(self._i, value)
+    else:
+      values = getattr(gg, name)
+      i = self._i
+      if gg.regions is not None and gg.regions.asleep:
+        gg.regions.touch(i)
+      if name == 'heat' and gg.cooling is not None:
+        gg.cooling.set(i, value)
+      if gg.tally is not None:
+        gg.tally.changed(name, i, values[i], value)
+      values[i] = value
+      gg.writes += 1
+      if gg.dirty is not None:
+        gg.dirty.add(self._i)
+
+  return property(getHeat if name == 'heat' else get, set)
+
+
+def components(points):
+  """8-connected groups of (x, y) points, ordered by where their first point comes up.
+
+  A breadth first flood over a set, so linear in the number of points.
+  """
+  points = list(points)
+  remaining = set(points)
+  groups = []
+  for start in points:
+    if not start in remaining:
+      continue
+
+    remaining.discard(start)
+    group = [start]
+    for (x, y) in group:
+      for ix in (-1, 0, 1):
+        for iy in (-1, 0, 1):
+          n = (x + ix, y + iy)
+          if n in remaining:
+            remaining.discard(n)
+            group.append(n)
+    groups.append(group)
+  return groups
+
+
+class BaseCell(object):
+  __slots__ = ('_grid', '_x', '_y', '_i', '_pressure', '_heat')
+  code = EMPTY
+  # kinds with no values of their own: placing one only writes its type
+  # code, so one shared instance (shared()) can be placed everywhere
+  stateless = False
+
+  def __init__(self, gameGrid=None):
+    # cells only get a grid (and a position) once they are placed
+    self._grid = None
+    self._x = 0
+    self._y = 0
+    self._i = -1
+
+  @classmethod
+  def shared(cls):
+    """The single detached instance of a stateless kind"""
+    cell = cls.__dict__.get('_shared')
+    if cell is None:
+      cell = cls()
+      cls._shared = cell
+    return cell
+
+  @classmethod
+  def view(cls, gameGrid, x, y, i):
+    cell = cls.__new__(cls)
+    cell._grid = gameGrid
+    cell._x = x
+    cell._y = y
+    cell._i = i
+    return cell
+
+  def bind(self, gameGrid, x, y, i):
+    """Fix a detached cell to its place, once"""
+    if self._grid is not None:
+      raise AttributeError("cell is already placed at %d, %d" % (self._x, self._y))
+    self._grid = gameGrid
+    self._x = x
+    self._y = y
+    self._i = i
+
+  gameGrid = property(lambda self: self._grid)
+  x = property(lambda self: self._x)
+  y = property(lambda self: self._y)
+  index = property(lambda self: self._i)
+
+  def getNeighbors(self):
+    if self._grid is None:
+      return []
+
+    return self._grid.neighborsAt(self._x, self._y)
+
+  def neighborIndices(self):
+    """Flat indices of the neighbors, -1 off the grid, without making cells"""
+    if self._grid is None:
+      return []
+
+    return self._grid.neighborIndices(self._x, self._y, self._i)
+
+  def update(self):
+    return False
+
+  def replace(self, instance):
+    if self._grid is not None:
+      self._grid[self._x, self._y] = instance
+
+    return instance
+
+  def values(self):
+    """(pressure, heat) of this cell, placed or not"""
+    gg = self._grid
+    if gg is None:
+      return getattr(self, '_pressure', 0), getattr(self, '_heat', 0)
+    return gg.pressure[self._i], gg.heatAt(self._i)
+
+
+def offGrid(*args):
+  raise AttributeError("cells off the grid are read only")
+
+
+class FixedPlane(tuple):
+  """A plane of the Edge, reads like any other and refuses writes"""
+  __slots__ = ()
+  __setitem__ = offGrid
+
+
+class Edge(object):
+  """The grid of the boundary cells: one HARD cell with no pressure or heat.
+
+  Every write to a cell placed here raises AttributeError, so the one
+  boundary cell a grid hands out for all positions off it stays as it is.
+  """
+  types = FixedPlane((HARD,))
+  pressure = FixedPlane((0,))
+  heat = FixedPlane((0,))
+  frontier = tally = cooling = regions = dirty = None
+
+  def heatAt(self, i):
+    return 0
+
+  def neighborsAt(self, x, y):
+    return []
+
+  def neighborIndices(self, x, y, i):
+    return []
+
+  setType = setPressure = place = __setitem__ = staticmethod(offGrid)
+
+EDGE = Edge()
+
+
+class GameGrid(object):
+  # cell class for each type code, filled in by the experiments
+  cellTypes = ()
+  cellSize = 8
+  # a gasrender.Palette draws the whole grid at once instead of cell by cell
+  palette = None
+  # the planes are flat arrays, what numpy and the file code need
+  dense = True
+
+  def __init__(self, w, h):
+    self.w = w
+    self.h = h
+    # flat index offsets of the neighbors, in NEIGHBORS order
+    self.deltas = [dy * w + dx for dx, dy in NEIGHBORS]
+    # the read only HARD cell standing in for every position off the grid
+    self.boundary = self.cellTypes[HARD].view(EDGE, -1, -1, 0) if self.cellTypes else None
+
+    self.types, self.pressure, self.heat = self.newPlanes(w * h)
+    self.frontier = None
+    self.tally = None
+    self.cooling = None
+    self.regions = None
+    # True while an update goes through the cells, heat set meanwhile cools from the next tick
+    self.stepping = False
+    # cells changed since the last render, None until the first full render
+    self.dirty = None
+    # goes up with every write through the grid, copies of the planes
+    # (gastiles) compare it to tell whether they are still current
+    self.writes = 0
+    # the models draw their random numbers from rng keyed by the tick count
+    self.tick = 0
+    self.rng = gasrandom.Streams(0)
+
+  def newPlanes(self, n):
+    return bytearray(n), array.array(PRESSURE, [0]) * n, array.array('h', [0]) * n
+
+  def reseed(self, seed):
+    self.rng = gasrandom.Streams(seed)
+
+  def random(self, cell):
+    """Random numbers of a cell for the current tick.
+
+    Keys from len(types) up belong to no cell, for draws made once per tick.
+    """
+    return self.rng.at(self.tick, cell)
+
+  def clone(self):
+    self.settle()
+    gg = self.__class__.__new__(self.__class__)
+    gg.__dict__.update(self.__dict__)
+    gg.types = bytearray(self.types)
+    gg.pressure = array.array(PRESSURE, self.pressure)
+    gg.heat = array.array('h', self.heat)
+    gg.frontier = None
+    gg.dirty = None
+    gg.tally = None
+    if self.tally is not None:
+      gg.trackTally()
+    gg.cooling = None
+    if self.cooling is not None:
+      gg.trackCooling(self.cooling.rate, self.cooling.events)
+    gg.regions = None
+    if self.regions is not None:
+      gg.trackRegions(self.regions.size, self.regions.idle)
+    return gg
+
+  def clear(self):
+    """Back to an all EMPTY world, in place"""
+    n = len(self.types)
+    self.types[:] = bytearray(n)
+    self.pressure[:] = array.array(PRESSURE, [0]) * n
+    self.heat[:] = array.array('h', [0]) * n
+    if self.frontier is not None:
+      self.frontier.reset()
+    self.retally()
+    self.dirty = None
+
+  def index(self, x, y):
+    return y * self.w + x
+
+  def inside(self, x, y):
+    return 0 <= x < self.w and 0 <= y < self.h
+
+  def typeAt(self, x, y):
+    if not (0 <= x < self.w and 0 <= y < self.h):
+      return HARD
+    return self.types[y * self.w + x]
+
+  def __getitem__(self, key):
+    x, y = key
+    if not (0 <= x < self.w and 0 <= y < self.h):
+      return self.boundary
+
+    i = y * self.w + x
+    return self.cellTypes[self.types[i]].view(self, x, y, i)
+
+  def neighborsAt(self, x, y):
+    """The 8 cells around x, y in NEIGHBORS order"""
+    w = self.w
+    if 0 < x < w - 1 and 0 < y < self.h - 1:
+      # away from the edges nothing needs a bounds check
+      cellTypes = self.cellTypes
+      types = self.types
+      i = y * w + x
+      return [cellTypes[types[i + d]].view(self, x + dx, y + dy, i + d)
+              for d, (dx, dy) in zip(self.deltas, NEIGHBORS)]
+
+    return [self[x + dx, y + dy] for dx, dy in NEIGHBORS]
+
+  def neighborIndices(self, x, y, i):
+    """Flat indices of the 8 cells around x, y (index i) in NEIGHBORS order.
+
+    Positions off the grid are -1, check for them before indexing a plane.
+    """
+    w = self.w
+    h = self.h
+    if 0 < x < w - 1 and 0 < y < h - 1:
+      return [i + d for d in self.deltas]
+    return [i + d if 0 <= x + dx < w and 0 <= y + dy < h else -1
+            for d, (dx, dy) in zip(self.deltas, NEIGHBORS)]
+
+  def neighborsOf(self, indices, offsets=NEIGHBORS):
+    """Neighbor type codes of many cells at once.
+
+    Returns a flat bytearray with len(offsets) codes per cell, in the order
+    of indices and offsets.  Positions off the grid read HARD.
+    """
+    w = self.w
+    h = self.h
+    types = self.types
+    deltas = self.deltas if offsets is NEIGHBORS else [dy * w + dx for dx, dy in offsets]
+    codes = []
+    for i in indices:
+      x = i % w
+      y = i // w
+      if 0 < x < w - 1 and 0 < y < h - 1:
+        codes += [types[i + d] for d in deltas]
+      else:
+        codes += [self.typeAt(x + dx, y + dy) for dx, dy in offsets]
+    return bytearray(codes)
+
+  def __setitem__(self, key, value):
+    x, y = key
+    i = y * self.w + x
+    pressure, heat = value.values()
+    self.place(i, value.code, pressure, heat)
+
+    # a cell that is already placed stays where it is, only its values move
+    if value._grid is None and not value.stateless:
+      value.bind(self, x, y, i)
+
+  def place(self, i, code, pressure=0, heat=0):
+    if self.regions is not None:
+      self.regions.touch(i, True)
+    if self.cooling is not None:
+      self.cooling.set(i, heat, code == GAS)
+    tally = self.tally
+    if tally is not None:
+      tally.remove(i)
+    self.types[i] = code
+    self.pressure[i] = saturate(pressure)
+    self.heat[i] = heat
+    self.writes += 1
+    if tally is not None:
+      tally.add(i)
+    if self.frontier is not None:
+      self.frontier.changed(i)
+    if self.dirty is not None:
+      self.dirty.add(i)
+
+  def setPressure(self, i, value):
+    """What cell.pressure = value does, for code that works on indices"""
+    if not PRESSURE_MIN <= value <= PRESSURE_MAX:
+      value = saturate(value)
+    if self.regions is not None and self.regions.asleep:
+      self.regions.touch(i)
+    pressure = self.pressure
+    if self.tally is not None:
+      self.tally.changed('pressure', i, pressure[i], value)
+    pressure[i] = value
+    self.writes += 1
+    if self.dirty is not None:
+      self.dirty.add(i)
+
+  def setType(self, i, code):
+    if self.regions is not None:
+      self.regions.touch(i, True)
+    if self.cooling is not None:
+      self.cooling.drop(i)
+      self.cooling.set(i, self.heat[i], code == GAS)
+    tally = self.tally
+    if tally is not None:
+      tally.remove(i)
+    self.types[i] = code
+    self.writes += 1
+    if tally is not None:
+      tally.add(i)
+    if self.frontier is not None:
+      self.frontier.changed(i)
+    if self.dirty is not None:
+      self.dirty.add(i)
+
+  def markDirty(self, indices):
+    """For code that writes the planes directly"""
+    self.writes += 1
+    if self.dirty is not None:
+      self.dirty.update(indices)
+
+  def invalidate(self):
+    """Repaint everything on the next render"""
+    self.dirty = None
+
+  def invalidateArea(self, rect):
+    """Repaint the cells under a screen rect, for things drawn over the grid"""
+    if self.dirty is None:
+      return
+
+    cs = self.cellSize
+    x0 = max(rect[0] // cs, 0)
+    y0 = max(rect[1] // cs, 0)
+    x1 = min((rect[0] + rect[2] - 1) // cs, self.w - 1)
+    y1 = min((rect[1] + rect[3] - 1) // cs, self.h - 1)
+    for y in range(y0, y1 + 1):
+      self.dirty.update(range(y * self.w + x0, y * self.w + x1 + 1))
+
+  def pendingCells(self):
+    """How many cells the next render paints"""
+    if self.dirty is None or (self.palette is not None and self.palette.enabled):
+      return len(self.types)
+    return len(self.dirty)
+
+  def uncover(self, surface, rects):
+    """Wipe what was drawn over the grid last frame, the next render repaints under it"""
+    for rect in rects:
+      surface.fill((0,0,0), rect)
+      self.invalidateArea(rect)
+
+  def render(self, surface):
+    """Paint the cells that changed since the last render.
+
+    Returns the screen rects that were painted, for pygame.display.update.
+    The first render (and the one after invalidate) paints every cell.
+    """
+    self.settle()
+    if self.palette is not None and self.palette.enabled:
+      self.dirty = set()
+      return [self.palette.render(self, surface)]
+
+    cs = self.cellSize
+    w = self.w
+    cellTypes = self.cellTypes
+    types = self.types
+
+    if self.dirty is None:
+      self.dirty = set()
+      area = (0, 0, w * cs, self.h * cs)
+      surface.fill((0,0,0), area)
+      for cell in self.allCells():
+        self.renderCell(surface, cell)
+      return [area]
+
+    dirty = self.dirty
+    self.dirty = set()
+    rects = []
+    for i in dirty:
+      x = i % w
+      y = i // w
+      self.renderCell(surface, cellTypes[types[i]].view(self, x, y, i))
+      rects.append((x * cs, y * cs, cs, cs))
+    return rects
+
+  def renderCell(self, surface, cell):
+    cs = self.cellSize
+    surface.fill(cell.getColor(), (cell.x * cs, cell.y * cs, cs-1, cs-1))
+
+  def trackFrontier(self, isActive):
+    """Keep the set of cells where isActive(i) holds up to date as types change"""
+    self.frontier = Frontier(self, isActive)
+    return self.frontier
+
+  def trackTally(self):
+    """Keep per type counts and pressure and the gas heat range up to date as cells change"""
+    self.tally = Tally(self)
+    return self.tally
+
+  def trackCooling(self, rate, events=False):
+    """Let gas heat drop by rate a tick, worked out when read (Cooling)"""
+    self.cooling = Cooling(self, rate, events)
+    return self.cooling
+
+  def trackRegions(self, size=16, idle=None):
+    """Let regions of size x size cells sleep while their gas is idle (Regions)"""
+    self.regions = Regions(self, size, idle)
+    return self.regions
+
+  def heatAt(self, i):
+    """Heat of cell i now"""
+    if self.cooling is not None:
+      return self.cooling.heat(i)
+    return self.heat[i]
+
+  def stepped(self, n):
+    """Update code that steps cells without taking them from cellsOf reports them here.
+
+    Does nothing, gasprofile.Profile.instrument counts them as updated.
+    """
+
+  def settle(self):
+    """Write the heat cooled off since it was set into the heat plane, before reading the planes whole"""
+    if self.cooling is not None:
+      self.cooling.settle()
+
+  def retally(self):
+    """For code that rewrites the planes wholesale, recounts the tally if there is one.
+
+    Wakes every region too and takes the heat plane as it is now.
+    """
+    self.writes += 1
+    if self.tally is not None:
+      self.tally.recount()
+    if self.cooling is not None:
+      self.cooling.reset()
+    if self.regions is not None:
+      self.regions.reset()
+
+  def conserving(self, update):
+    """Run update() and report any change it made to the total pressure, for debugging"""
+    if self.tally is None:
+      self.trackTally()
+    before = self.tally.total()
+    update()
+    after = self.tally.total()
+    if after != before:
+      print("tick %d: pressure %d -> %d, %+d" % (self.tick, before, after, after - before))
+    self.tally.verify()
+
+  def indicesOf(self, code):
+    """Plane indices of every cell with the given type code, in row order"""
+    types = self.types
+    find = types.find
+    needle = bytearray([code])
+    i = find(needle)
+    while i >= 0:
+      yield i
+      i = find(needle, i + 1)
+
+  def indicesIn(self, code, x0, y0, x1, y1):
+    """Plane indices of the cells with code where x0 <= x < x1 and y0 <= y < y1, in row order"""
+    find = self.types.find
+    needle = bytearray([code])
+    w = self.w
+    x1 = min(x1, w)
+    for y in range(y0, min(y1, self.h)):
+      end = y * w + x1
+      i = find(needle, y * w + x0, end)
+      while i >= 0:
+        yield i
+        i = find(needle, i + 1, end)
+
+  def cellsOf(self, code):
+    w = self.w
+    cls = self.cellTypes[code]
+    for i in self.indicesOf(code):
+      yield cls.view(self, i % w, i // w, i)
+
+  def allCells(self):
+    w = self.w
+    cellTypes = self.cellTypes
+    types = self.types
+    for i in range(len(types)):
+      yield cellTypes[types[i]].view(self, i % w, i // w, i)
+
+  def countOf(self, code):
+    if self.tally is not None:
+      return self.tally.counts[code]
+    return self.types.count(bytearray([code]))
+
+  def pressureOf(self, code):
+    if self.tally is not None:
+      return self.tally.pressure[code]
+    pressure = self.pressure
+    total = 0
+    for i in self.indicesOf(code):
+      total += pressure[i]
+    return total
+
+
+class Frontier(object):
+  """Cells near the gas interface, maintained incrementally.
+
+  Whenever a cell changes type it and its 8 neighbors are queued, and
+  update() re-evaluates just those, so the cost per tick follows the
+  length of the interface instead of the size of the grid.  Code that
+  writes the type plane directly has to report the cells through changed().
+  """
+
+  def __init__(self, gameGrid, isActive):
+    self.gameGrid = gameGrid
+    self.isActive = isActive
+    self.active = set()
+    self.pending = set()
+    for code in set(gameGrid.types) - set([EMPTY]):
+      self.pending.update(gameGrid.indicesOf(code))
+
+  def reset(self):
+    """Forget everything, the grid was cleared"""
+    self.active.clear()
+    self.pending.clear()
+
+  def changed(self, i):
+    self.pending.add(i)
+
+  def update(self):
+    gg = self.gameGrid
+    w = gg.w
+    h = gg.h
+    active = self.active
+    isActive = self.isActive
+    for i in self.pending:
+      x = i % w
+      y = i // w
+      for ny in range(max(y - 1, 0), min(y + 2, h)):
+        for nx in range(max(x - 1, 0), min(x + 2, w)):
+          j = ny * w + nx
+          if isActive(j):
+            active.add(j)
+          else:
+            active.discard(j)
+    self.pending.clear()
+
+  def ordered(self):
+    """Active cells in row order, after catching up with pending changes"""
+    self.update()
+    return sorted(self.active)
+
+
+class Tally(object):
+  """Counts and pressure totals per type code, and a histogram of gas heat.
+
+  place, setType and the cell plane attributes take a cell out of the
+  totals before writing it and put it back after, so reading them costs
+  nothing.  Code that writes the planes directly calls gg.retally().
+  """
+
+  def __init__(self, gameGrid):
+    self.gameGrid = gameGrid
+    self.recount()
+
+  def recount(self):
+    gg = self.gameGrid
+    self.counts = [0] * 256
+    self.pressure = [0] * 256
+    # heat value -> gas cells that hot, only the values some cell has
+    self.heat = collections.Counter()
+    if numpy is not None and gg.dense:
+      t = numpy.frombuffer(gg.types, dtype=numpy.uint8)
+      p = numpy.frombuffer(gg.pressure, dtype=PRESSURE)
+      heat = numpy.frombuffer(gg.heat, dtype=numpy.int16)
+      self.counts = numpy.bincount(t, minlength=256).tolist()
+      self.pressure = [int(v) for v in numpy.bincount(t, weights=p, minlength=256)]
+      heat = heat[t == GAS]
+      if len(heat):
+        low = int(heat.min())
+        counts = numpy.bincount(heat - low)
+        for k in numpy.flatnonzero(counts).tolist():
+          self.heat[low + k] = int(counts[k])
+      return
+
+    for code in set(gg.types) - set([EMPTY]):
+      for i in gg.indicesOf(code):
+        self.counts[code] += 1
+        self.pressure[code] += gg.pressure[i]
+        if code == GAS:
+          self.heat[gg.heat[i]] += 1
+    self.counts[EMPTY] = len(gg.types) - sum(self.counts)
+
+  def remove(self, i):
+    gg = self.gameGrid
+    code = gg.types[i]
+    self.counts[code] -= 1
+    self.pressure[code] -= gg.pressure[i]
+    if code == GAS:
+      heat = self.heat
+      h = gg.heat[i]
+      heat[h] -= 1
+      if not heat[h]:
+        del heat[h]
+
+  def add(self, i):
+    gg = self.gameGrid
+    code = gg.types[i]
+    self.counts[code] += 1
+    self.pressure[code] += gg.pressure[i]
+    if code == GAS:
+      self.heat[gg.heat[i]] += 1
+
+  def changed(self, name, i, old, new):
+    """Plane name of cell i goes from old to new, its type stays"""
+    code = self.gameGrid.types[i]
+    if name == 'pressure':
+      self.pressure[code] += new - old
+    elif code == GAS and old != new:
+      heat = self.heat
+      heat[old] -= 1
+      if not heat[old]:
+        del heat[old]
+      heat[new] += 1
+
+  def assume(self, counts, pressure, heatRange):
+    """Take totals counted elsewhere (gasworker frames) instead of recounting.
+
+    Only the ends of the heat histogram come along, enough for heatRange().
+    """
+    self.counts = list(counts) + [0] * (256 - len(counts))
+    self.pressure = list(pressure) + [0] * (256 - len(pressure))
+    self.heat = collections.Counter(heatRange or ())
+
+  def total(self):
+    """Pressure of the whole grid"""
+    return sum(self.pressure)
+
+  def heatRange(self):
+    """(coldest, hottest) gas cell, None without gas"""
+    if not self.heat:
+      return None
+    return min(self.heat), max(self.heat)
+
+  def verify(self):
+    """Raise if the totals drifted from the planes, something wrote them behind our back"""
+    fresh = Tally(self.gameGrid)
+    if (fresh.counts, fresh.pressure, fresh.heat) != (self.counts, self.pressure, self.heat):
+      raise AssertionError("tally out of step with the planes at tick %d" % self.gameGrid.tick)
+
+
+def drained(gg, i):
+  """Gas with no pressure left to push, what Regions waits for by default"""
+  return not gg.pressure[i]
+
+
+class Regions(object):
+  """Squares of the grid that sleep through the update while nothing happens in them.
+
+  A region falls asleep after a tick in which none of its cells changed
+  type and all of its gas is idle(gg, i), by default when it has no
+  pressure left; with its heat kept by Cooling, gas like that does nothing
+  a tick.  Anything written into the region wakes it, and so does a type
+  change along its border.  A region woken part way through an update
+  joins in where the update has got to, so its cells further on still get
+  their turn that tick and sleeping never changes the outcome.
+  """
+
+  def __init__(self, gameGrid, size=16, idle=None):
+    self.gameGrid = gameGrid
+    self.size = size
+    self.idle = idle or drained
+    self.cols = (gameGrid.w + size - 1) // size
+    # regions the update visits, None until they are found again from the types
+    self.awake = None
+    self.asleep = set()
+    # regions edited this tick
+    self.stirred = set()
+    # cell the update is at, None between updates, and the cells woken after it
+    self.position = None
+    self.code = None
+    self.woken = []
+
+  def region(self, i):
+    y, x = divmod(i, self.gameGrid.w)
+    return (y // self.size) * self.cols + x // self.size
+
+  def bounds(self, r):
+    """x0, y0, x1, y1 of region r"""
+    y, x = divmod(r, self.cols)
+    size = self.size
+    return x * size, y * size, (x + 1) * size, (y + 1) * size
+
+  def touch(self, i, edit=False):
+    """Cell i is about to be written, wake its region first.
+
+    An edit (a type change) also keeps the region awake for the tick and
+    wakes the regions across the border from i.
+    """
+    asleep = self.asleep
+    if not edit and not asleep:
+      return
+    w = self.gameGrid.w
+    size = self.size
+    y, x = divmod(i, w)
+    r = (y // size) * self.cols + x // size
+    if r in asleep:
+      self.wake(r)
+    if not edit:
+      return
+    self.stirred.add(r)
+    if self.awake is not None:
+      self.awake.add(r)
+    if asleep and (x % size in (0, size - 1) or y % size in (0, size - 1)):
+      for ny in range(max(y - 1, 0), min(y + 2, self.gameGrid.h)):
+        for nx in range(max(x - 1, 0), min(x + 2, w)):
+          n = (ny // size) * self.cols + nx // size
+          if n in asleep:
+            self.wake(n)
+
+  def wake(self, r):
+    self.asleep.discard(r)
+    if self.awake is not None:
+      self.awake.add(r)
+    if self.position is not None:
+      for j in self.gameGrid.indicesIn(self.code, *self.bounds(r)):
+        if j > self.position:
+          heapq.heappush(self.woken, j)
+
+  def reset(self):
+    """Everything awake, the planes were rewritten"""
+    self.awake = None
+    self.asleep.clear()
+    self.stirred.clear()
+
+  def indicesOf(self, code):
+    gg = self.gameGrid
+    if self.awake is None:
+      self.awake = set()
+      for c in set(gg.types) - set([EMPTY]):
+        self.awake.update(self.region(i) for i in gg.indicesOf(c))
+    if not self.asleep:
+      return list(gg.indicesOf(code))
+    indices = []
+    for r in self.awake:
+      indices.extend(gg.indicesIn(code, *self.bounds(r)))
+    indices.sort()
+    return indices
+
+  def cellsOf(self, code):
+    """Views of the cells with code in the awake regions, in row order, for one tick's update"""
+    gg = self.gameGrid
+    w = gg.w
+    cls = gg.cellTypes[code]
+    indices = self.indicesOf(code)
+    gg.stepping = True
+    try:
+      if not self.asleep:
+        # nothing to wake on the way
+        for i in indices:
+          yield cls.view(gg, i % w, i // w, i)
+        return
+      n = len(indices)
+      k = 0
+      self.code = code
+      self.woken = woken = []
+      while k < n or woken:
+        if woken and (k == n or woken[0] < indices[k]):
+          i = heapq.heappop(woken)
+        else:
+          i = indices[k]
+          k += 1
+        self.position = i
+        yield cls.view(gg, i % w, i // w, i)
+    finally:
+      self.position = None
+      gg.stepping = False
+
+  def rest(self):
+    """After a tick, put the awake regions nothing happened in to sleep"""
+    if self.awake is None:
+      return
+    gg = self.gameGrid
+    idle = self.idle
+    for r in self.awake - self.stirred:
+      for j in gg.indicesIn(GAS, *self.bounds(r)):
+        if not idle(gg, j):
+          break
+      else:
+        self.awake.discard(r)
+        self.asleep.add(r)
+    self.stirred.clear()
+
+
+def cooled(heat, ticks, rate):
+  """heat after ticks of losing rate a tick for as long as it is above 0"""
+  if heat <= 0 or ticks <= 0:
+    return heat
+  return heat - rate * min(ticks, (heat + rate - 1) // rate)
+
+
+class Cooling(object):
+  """Gas heat that drops by rate every tick, without being counted down.
+
+  The heat plane holds the heat a gas cell had when warm[i], the first tick
+  it has not cooled through yet, and heat(i) works out what is left of it
+  now, so heat costs nothing a tick; cells reach 0 and drop out of warm.
+  settle() writes the cooled heat of the warm cells into the plane for the
+  code that reads it whole.
+
+  With events, expire() hands out the gas cells whose heat runs out, on
+  the first tick they start with none left, from a heap keyed by that tick.
+  """
+
+  def __init__(self, gameGrid, rate, events=False):
+    self.gameGrid = gameGrid
+    self.rate = rate
+    self.events = events
+    # warm gas cell -> first tick it has not cooled through
+    self.warm = {}
+    # (tick its heat runs out, cell), and the latest of those ticks per cell, older entries are stale
+    self.due = []
+    self.expiry = {}
+    # tick of the last settle, and whether something else (a kernel) does the cooling meanwhile
+    self.settled = None
+    self.paused = False
+    self.recount()
+
+  def recount(self):
+    """Take the heat plane as it is now, every gas cell cools from this tick"""
+    gg = self.gameGrid
+    tick = gg.tick
+    if numpy is not None and gg.dense:
+      t = numpy.frombuffer(gg.types, dtype=numpy.uint8)
+      heat = numpy.frombuffer(gg.heat, dtype=numpy.int16)
+      warm = numpy.flatnonzero((t == GAS) & (heat > 0)).tolist()
+    else:
+      warm = [i for i in gg.indicesOf(GAS) if gg.heat[i] > 0]
+    self.warm = dict.fromkeys(warm, tick)
+    self.settled = tick
+    self.due = []
+    self.expiry = {}
+    if self.events:
+      heat = gg.heat
+      rate = self.rate
+      for i in warm:
+        self.expiry[i] = tick + (heat[i] + rate - 1) // rate
+      self.due = [(e, i) for i, e in self.expiry.items()]
+      heapq.heapify(self.due)
+
+  def heat(self, i):
+    h = self.gameGrid.heat[i]
+    since = self.warm.get(i)
+    if since is None:
+      return h
+    return cooled(h, self.gameGrid.tick - since, self.rate)
+
+  def set(self, i, heat, gas=True):
+    """Heat is about to be written to cell i"""
+    if self.paused:
+      return
+    gg = self.gameGrid
+    since = gg.tick + gg.stepping
+    if gas and heat > 0:
+      self.warm[i] = since
+    else:
+      self.warm.pop(i, None)
+    if self.events:
+      if gas:
+        e = since + max(heat + self.rate - 1, 0) // self.rate
+        self.expiry[i] = e
+        heapq.heappush(self.due, (e, i))
+      else:
+        self.expiry.pop(i, None)
+
+  def drop(self, i):
+    """Write the heat of cell i into the plane and stop cooling it"""
+    if i in self.warm:
+      self.write(i, self.heat(i))
+      del self.warm[i]
+    self.expiry.pop(i, None)
+
+  def write(self, i, heat):
+    gg = self.gameGrid
+    if gg.tally is not None:
+      gg.tally.changed('heat', i, gg.heat[i], heat)
+    gg.heat[i] = heat
+    gg.writes += 1
+    if gg.dirty is not None:
+      gg.dirty.add(i)
+
+  def settle(self):
+    """Write the heat of every warm cell into the plane"""
+    tick = self.gameGrid.tick
+    if self.paused or self.settled == tick:
+      return
+    warm = self.warm
+    plane = self.gameGrid.heat
+    rate = self.rate
+    for i, since in list(warm.items()):
+      if since < tick:
+        heat = cooled(plane[i], tick - since, rate)
+        self.write(i, heat)
+        if heat > 0:
+          warm[i] = tick
+        else:
+          del warm[i]
+    self.settled = tick
+
+  def expire(self):
+    """Gas cells whose heat has run out by this tick, in row order"""
+    gg = self.gameGrid
+    due = self.due
+    expiry = self.expiry
+    types = gg.types
+    tick = gg.tick
+    cells = []
+    while due and due[0][0] <= tick:
+      e, i = heapq.heappop(due)
+      if expiry.get(i) == e and types[i] == GAS:
+        del expiry[i]
+        cells.append(i)
+    cells.sort()
+    return cells
+
+  def pause(self):
+    """Settle and leave the heat plane to code that cools it every tick itself"""
+    self.settle()
+    self.paused = True
+    self.warm = {}
+    self.due = []
+    self.expiry = {}
+
+  def resume(self):
+    if self.paused:
+      self.paused = False
+      self.recount()
+
+  def reset(self):
+    """The planes were rewritten, take them as they are"""
+    if not self.paused:
+      self.recount()
@@ -0,0 +1,224 @@
+"""Whole grid numpy kernels for the gas experiments.
+
+These work directly on the gasgrid planes (numpy views over the same
+memory, no copies) and replace the per cell python update loops.  numpy is
+optional, the experiments fall back to their cell by cell update without it.
+
+The kernels work on a Window: planes for a run of whole rows plus the index
+of its first cell in the world, which keys the random numbers.  For a whole
+grid that is just views of its planes; gastiles gives each worker process
+a window over its own band of rows.
+"""
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+import gasgrid
+
+# same order as BaseCell.getNeighbors
+OFFSETS = gasgrid.NEIGHBORS
+# neighbors the sequential row order updates after the cell itself
+FORWARD = [4, 5, 6, 7]
+
+
+def available():
+  return numpy is not None
+
+
+def planes(gg):
+  """numpy views of the type, pressure and heat planes of a grid"""
+  return (numpy.frombuffer(gg.types, dtype=numpy.uint8),
+          numpy.frombuffer(gg.pressure, dtype=gasgrid.PRESSURE),
+          numpy.frombuffer(gg.heat, dtype=numpy.int16))
+
+
+class Window(object):
+  """numpy planes of h whole rows, the first cell being cell base of the world"""
+
+  def __init__(self, t, p, heat, w, rng, tick, base=0):
+    self.t = t
+    self.p = p
+    self.heat = heat
+    self.w = w
+    self.h = len(t) // w
+    self.rng = rng
+    self.tick = tick
+    self.base = base
+    # index arrays of the cells written, for the dirty tracking
+    self.touched = []
+
+  @classmethod
+  def of(cls, gg):
+    t, p, heat = planes(gg)
+    return cls(t, p, heat, gg.w, gg.rng, gg.tick)
+
+
+def neighborhood(win, idx):
+  """Neighbor plane indices and types, shape (8, len(idx)), out of bounds reads HARD"""
+  w = win.w
+  h = win.h
+  t = win.t
+  ys = idx // w
+  xs = idx % w
+  nidx = numpy.empty((8, len(idx)), dtype=numpy.intp)
+  ntype = numpy.empty((8, len(idx)), dtype=numpy.uint8)
+  for d, (dx, dy) in enumerate(OFFSETS):
+    nx = xs + dx
+    ny = ys + dy
+    valid = (nx >= 0) & (nx < w) & (ny >= 0) & (ny < h)
+    n = numpy.where(valid, ny * w + nx, 0)
+    nidx[d] = n
+    ntype[d] = numpy.where(valid, t[n], gasgrid.HARD)
+  return nidx, ntype
+
+
+def draws(win, idx, k):
+  """(8, n) random numbers, draws k to k + 7 of every cell in idx"""
+  return win.rng.uniform(win.tick, (idx + win.base)[None, :], k + numpy.arange(8)[:, None])
+
+
+def randomPick(keys, mask, count):
+  """For each column pick `count` of the rows set in mask, lowest keys first"""
+  keys = keys.copy()
+  keys[~mask] = 2.0
+  rank = keys.argsort(axis=0).argsort(axis=0)
+  return mask & (rank < count)
+
+
+def claimAir(win, idx, nidx, air, budget, draw, rounds=4):
+  """Hand out air neighbors to gas cells, at most budget each, one winner per air cell.
+
+  Cells that lose a contested air cell retry on what is still free, like a
+  later cell in the sequential loop would just see that cell as gas already.
+  Returns the (8, n) claim mask and the plane mask of every claimed cell.
+  """
+  claim = numpy.zeros(air.shape, dtype=bool)
+  taken = numpy.zeros(len(win.t), dtype=bool)
+  free = air
+
+  for r in range(rounds):
+    pick = randomPick(draws(win, idx, draw + r * 16), free, budget)
+    target = nidx[pick]
+    if not len(target):
+      break
+
+    # the contender with the lowest draw gets a contested cell
+    order = draws(win, idx, draw + r * 16 + 8)[pick].argsort()
+    first = numpy.unique(target[order], return_index=True)[1]
+    won = numpy.zeros(len(target), dtype=bool)
+    won[order[first]] = True
+
+    wins = numpy.zeros(air.shape, dtype=bool)
+    wins[pick] = won
+    claim |= wins
+    budget = budget - wins.sum(axis=0)
+    taken[target] = True
+
+    if won.all():
+      break
+    free = free & ~taken[nidx] & ~claim
+
+  return claim, taken
+
+
+def spread(win, idx, amount, newHeat, draw):
+  """Push amount out of each cell in idx following the GasCell.update rules.
+
+  The random numbers used are draws draw to draw + 71 of each cell.
+  Returns the neighbor indices and the (8, n) amounts that were moved.
+  """
+  t, p, heat = win.t, win.p, win.heat
+  nidx, ntype = neighborhood(win, idx)
+
+  air = ntype == gasgrid.EMPTY
+  claim, taken = claimAir(win, idx, nidx, air, amount, draw)
+  left = amount - claim.sum(axis=0)
+
+  # anything left is shared with the gas around us, including air taken just now
+  share = (ntype == gasgrid.GAS) | (air & taken[nidx])
+  count = share.sum(axis=0)
+  sharing = (left > 0) & (count > 0)
+  count[~sharing] = 1
+  even = numpy.where(sharing, left // count, 0)
+  extra = randomPick(draws(win, idx, draw + 64), share & sharing, numpy.where(sharing, left % count, 0))
+  out = claim + share * even + extra
+
+  claimed = nidx[claim]
+  if len(claimed):
+    t[claimed] = gasgrid.GAS
+    heat[claimed] = newHeat
+
+  p[idx] -= amount - numpy.where(sharing, 0, left)
+  moved = out > 0
+  # the cells in idx are distinct, so are their neighbors in one direction
+  for d in range(len(OFFSETS)):
+    addSaturated(p, nidx[d][moved[d]], out[d][moved[d]])
+  win.touched += [idx, nidx[moved]]
+  return nidx, out
+
+
+def addSaturated(p, idx, amount):
+  """p[idx] += amount for distinct idx and amount >= 0, stopping at gasgrid.PRESSURE_MAX"""
+  p[idx] = numpy.minimum(p[idx], gasgrid.PRESSURE_MAX - amount) + amount
+
+
+def sources(win, gas):
+  """Cells that push their pressure in the first step of a tick, and how much"""
+  idx = numpy.flatnonzero(gas & (win.p > 0))
+  return idx, win.p[idx]
+
+
+def forwardStep(win, gas, idx, amount, step, newHeat=100):
+  """Spread amount out of the cells in idx, step counts the steps of this tick.
+
+  Returns the cells that received pressure moving forward in row order and
+  were gas when the tick started (gas), with what they received: they push
+  that on again in the next step.
+  """
+  nidx, out = spread(win, idx, amount, newHeat, step * 80)
+
+  incoming = numpy.zeros(len(win.t), dtype=win.p.dtype)
+  for d in FORWARD:
+    again = (out[d] > 0) & gas[nidx[d]]
+    addSaturated(incoming, nidx[d][again], out[d][again])
+  idx = numpy.flatnonzero(incoming)
+  return idx, incoming[idx]
+
+
+def cool(win, gas, heatLoss=5):
+  hot = gas & (win.heat > 0)
+  win.heat[hot] -= heatLoss
+  win.touched.append(numpy.flatnonzero(hot))
+
+
+def spindlyStep(gg, heatLoss=5, newHeat=100):
+  """One tick of the spindly GasCell.update rules over the whole grid.
+
+  Every gas cell with pressure pushes one unit into as many randomly chosen
+  air neighbors as it can, then shares what is left evenly over its gas
+  neighbors (the remainder going to random ones).  Cells read the state from
+  the start of the step instead of whatever earlier cells already wrote.
+
+  The sequential loop lets pressure that moves forward in row order (right
+  or down) be pushed on again by the receiving cell in the same tick, so
+  that is replayed in follow up steps over just the pressure that arrived
+  that way.  Pressure is conserved exactly and the foam grows at the same
+  rate on average, but a given seed does not reproduce the cell loop.
+
+  Random numbers come from gg.rng keyed by cell and tick, so the result
+  does not depend on how the cells are batched.
+  """
+  win = Window.of(gg)
+  gas = win.t == gasgrid.GAS
+  idx, amount = sources(win, gas)
+
+  step = 0
+  while len(idx):
+    idx, amount = forwardStep(win, gas, idx, amount, step, newHeat)
+    step += 1
+
+  cool(win, gas, heatLoss)
+  for touched in win.touched:
+    gg.markDirty(touched.tolist())
+  gg.retally()
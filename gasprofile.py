@@ -0,0 +1,195 @@
+"""Where the time of a frame goes.
+
+A Profile times named phases and keeps the last window samples of each for
+percentiles, and adds up counters (cells updated, cells rendered, neighbor
+lookups, cell views made).  The cells updated are counted as the update
+loop takes them from gg.regions.cellsOf, sleeping regions left out, or as
+the whole grid kernels report them through gg.stepped():
+
+  profile = Profile()
+  profile.enabled = True
+  profile.instrument(gg)                 count lookups and views on gg
+  rects = profile.run('render', gg.render, screen)
+  profile.count('rendered', n)
+  profile.frame()                        once per frame, closes the counters
+  profile.describe()                     overlay lines
+  profile.export('run.csv')              or .json
+
+Disabled, run() is just the call and count() returns at once, and
+instrument() only wraps the grid's methods while enabled, so leaving the
+hooks in the main loops costs next to nothing.
+"""
+import collections
+import csv
+import json
+import time
+
+
+def percentile(values, p):
+  """Nearest rank percentile, None without values"""
+  ordered = sorted(values)
+  if not ordered:
+    return None
+  k = min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered) + 0.5)) - 1))
+  return ordered[k]
+
+
+class Profile(object):
+  def __init__(self, window=120):
+    self.enabled = False
+    self.window = window
+    self.clock = time.time
+    # phase -> recent durations in seconds, phases in the order first seen
+    self.samples = {}
+    self.phases = []
+    self.totals = collections.Counter()
+    self.calls = collections.Counter()
+    # counters of the frame going on, of the last one, and since the start
+    self.counters = collections.Counter()
+    self.shown = collections.Counter()
+    self.counted = collections.Counter()
+    self.frames = 0
+    self.grid = None
+
+  def run(self, name, fn, *args):
+    """fn(*args), timed as phase name when enabled"""
+    if not self.enabled:
+      return fn(*args)
+    start = self.clock()
+    try:
+      return fn(*args)
+    finally:
+      self.add(name, self.clock() - start)
+
+  def add(self, name, seconds):
+    samples = self.samples.get(name)
+    if samples is None:
+      samples = self.samples[name] = collections.deque(maxlen=self.window)
+      self.phases.append(name)
+    samples.append(seconds)
+    self.totals[name] += seconds
+    self.calls[name] += 1
+
+  def count(self, name, n=1):
+    if self.enabled:
+      self.counters[name] += n
+
+  def frame(self):
+    if not self.enabled:
+      return
+    self.shown = self.counters
+    self.counted.update(self.counters)
+    self.counters = collections.Counter()
+    self.frames += 1
+
+  def toggle(self):
+    self.enabled = not self.enabled
+    if self.grid is not None:
+      self.instrument(self.grid)
+
+  def instrument(self, gg):
+    """Count neighbor lookups, cell views and updated cells on gg while enabled.
+
+    The counting versions shadow the grid's methods on the instance only,
+    so nothing else pays for them and disabling puts the originals back.
+    """
+    self.grid = gg
+    regions = gg.regions
+    for name in ('neighborsAt', 'neighborIndices', 'neighborsOf', 'cellsOf', 'stepped'):
+      gg.__dict__.pop(name, None)
+    if regions is not None:
+      regions.__dict__.pop('cellsOf', None)
+    if not self.enabled:
+      return
+
+    neighborsAt = gg.neighborsAt
+    neighborIndices = gg.neighborIndices
+    neighborsOf = gg.neighborsOf
+    cellsOf = gg.cellsOf
+    counters = lambda: self.counters
+
+    def countedNeighborsAt(x, y):
+      cells = neighborsAt(x, y)
+      c = counters()
+      c['lookups'] += 1
+      c['views'] += len(cells)
+      return cells
+
+    def countedNeighborIndices(x, y, i):
+      counters()['lookups'] += 1
+      return neighborIndices(x, y, i)
+
+    def countedNeighborsOf(indices, *args):
+      counters()['lookups'] += len(indices)
+      return neighborsOf(indices, *args)
+
+    def countedStepped(n):
+      counters()['updated'] += n
+
+    def countedCellsOf(code):
+      c = counters()
+      for cell in cellsOf(code):
+        c['views'] += 1
+        yield cell
+
+    gg.neighborsAt = countedNeighborsAt
+    gg.neighborIndices = countedNeighborIndices
+    gg.stepped = countedStepped
+    gg.neighborsOf = countedNeighborsOf
+    gg.cellsOf = countedCellsOf
+
+    if regions is not None:
+      awakeCellsOf = regions.cellsOf
+
+      def countedAwakeCellsOf(code):
+        c = counters()
+        for cell in awakeCellsOf(code):
+          c['updated'] += 1
+          c['views'] += 1
+          yield cell
+
+      regions.cellsOf = countedAwakeCellsOf
+
+  def summary(self, name):
+    samples = self.samples[name]
+    return {
+      'calls': self.calls[name],
+      'total': self.totals[name],
+      'mean': self.totals[name] / self.calls[name],
+      'p50': percentile(samples, 50),
+      'p90': percentile(samples, 90),
+      'p99': percentile(samples, 99),
+      'max': max(samples),
+    }
+
+  def describe(self):
+    """Overlay lines: p50/p99 of every phase in ms, then the last frame's counters"""
+    if not self.enabled:
+      return []
+    phases = ["%s %.1f/%.1f" % (name, 1000 * percentile(self.samples[name], 50),
+                                1000 * percentile(self.samples[name], 99)) for name in self.phases]
+    counters = ["%s %d" % (name, self.shown[name]) for name in sorted(self.shown)]
+    return ["ms p50/p99: " + "  ".join(phases), "per frame: " + "  ".join(counters)]
+
+  def report(self):
+    return {
+      'frames': self.frames,
+      'phases': dict((name, self.summary(name)) for name in self.phases),
+      'counters': dict(self.counted + self.counters),
+    }
+
+  def export(self, path):
+    """Write report() as JSON, or as CSV rows when path ends in .csv"""
+    report = self.report()
+    with open(path, 'w') as f:
+      if not path.endswith('.csv'):
+        json.dump(report, f, indent=1, sort_keys=True)
+        return
+      columns = ['calls', 'total', 'mean', 'p50', 'p90', 'p99', 'max']
+      out = csv.writer(f)
+      out.writerow(['name'] + columns)
+      for name in self.phases:
+        summary = report['phases'][name]
+        out.writerow([name] + [summary[c] for c in columns])
+      for name, value in sorted(report['counters'].items()):
+        out.writerow([name, value] + [''] * (len(columns) - 1))
@@ -0,0 +1,257 @@
+"""Counter based random numbers for the gas experiments.
+
+Every random number is a hash of (seed, tick, cell, draw): the draw-th
+number cell used in that tick.  Nothing is carried from one number to the
+next, so it does not matter in which order cells are updated, whether
+they are updated one by one or as numpy arrays, or how the grid is split
+between workers; the same seed always gives the same numbers to the same
+cells.  So the spindly kernel ends in the same world for a seed in one
+process or tiled over workers.  Its cell by cell update is a different
+algorithm that asks for its numbers in other places, it agrees with the
+kernel only on average.
+
+  rng = Streams(seed)
+  r = rng.at(tick, i)          numbers for one cell, like the random module
+  r.shuffle(neighbors); r.randint(0, 7)
+  rng.uniform(tick, idx, k)    draw k of every cell in the index array idx
+
+Stream.split hands out a whole amount of pressure over some neighbors with
+a few exact binomial draws, instead of picking a neighbor for every unit;
+amounts no bigger than the number of neighbors do take a draw per unit,
+that is the cheaper way for them.
+"""
+import math
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+MASK = (1 << 64) - 1
+GOLDEN = 0x9E3779B97F4A7C15
+M1 = 0xBF58476D1CE4E5B9
+M2 = 0x94D049BB133111EB
+# 53 random bits make a double in [0, 1)
+UNIT = 1.0 / (1 << 53)
+
+
+def mix(z):
+  """splitmix64 finalizer"""
+  z = ((z ^ (z >> 30)) * M1) & MASK
+  z = ((z ^ (z >> 27)) * M2) & MASK
+  return z ^ (z >> 31)
+
+
+def mixArray(z):
+  z = (z ^ (z >> numpy.uint64(30))) * numpy.uint64(M1)
+  z = (z ^ (z >> numpy.uint64(27))) * numpy.uint64(M2)
+  return z ^ (z >> numpy.uint64(31))
+
+
+class Streams(object):
+  """All the random numbers of one seeded run"""
+
+  def __init__(self, seed=0):
+    self.seed = seed & MASK
+    self.key = mix((self.seed * GOLDEN) & MASK)
+    # the key of the last tick asked for, every cell of a tick needs it
+    self.tick = None
+    self.tickKey = None
+
+  def keyOf(self, tick):
+    if tick != self.tick:
+      self.tickKey = mix((self.key + tick * GOLDEN) & MASK)
+      self.tick = tick
+    return self.tickKey
+
+  def base(self, tick, cell):
+    return mix(self.keyOf(tick) ^ ((cell * M2) & MASK))
+
+  def at(self, tick, cell):
+    """The numbers of one cell (or any other integer key) in one tick, one mix to set up"""
+    return Stream(self.base(tick, cell))
+
+  def bits(self, tick, cells, draw):
+    """64 random bits for draw number draw of every cell in the array cells"""
+    with numpy.errstate(over='ignore'):
+      tickKey = numpy.uint64(self.keyOf(tick))
+      base = mixArray(tickKey ^ (numpy.asarray(cells).astype(numpy.uint64) * numpy.uint64(M2)))
+      return mixArray(base + numpy.asarray(draw).astype(numpy.uint64) * numpy.uint64(GOLDEN))
+
+  def uniform(self, tick, cells, draw):
+    """Doubles in [0, 1), the same ones Stream.random gives for those draws"""
+    return (self.bits(tick, cells, draw) >> numpy.uint64(11)).astype(numpy.float64) * UNIT
+
+
+def stirling(x):
+  """Correction term of Stirling's series for log x!, to 1 / x ** 9"""
+  x2 = x * x
+  return (13860.0 - (462.0 - (132.0 - (99.0 - 140.0 / x2) / x2) / x2) / x2) / x / 166320.0
+
+
+class Stream(object):
+  """Successive numbers of one cell, with the random module methods the models use.
+
+  Draw d is mix(base + d * GOLDEN), one mix a number; the mix is written
+  out in random() too, a call less on the hot path of the cell updates.
+  """
+  __slots__ = ('counter',)
+
+  def __init__(self, base):
+    # base + draw * GOLDEN of the next draw
+    self.counter = base
+
+  def bits(self):
+    z = self.counter
+    self.counter = (z + GOLDEN) & MASK
+    return mix(z)
+
+  def random(self):
+    z = self.counter
+    self.counter = (z + GOLDEN) & MASK
+    z = ((z ^ (z >> 30)) * M1) & MASK
+    z = ((z ^ (z >> 27)) * M2) & MASK
+    return ((z ^ (z >> 31)) >> 11) * UNIT
+
+  def randrange(self, n):
+    return int(self.random() * n)
+
+  def randint(self, a, b):
+    return a + self.randrange(b - a + 1)
+
+  def choice(self, seq):
+    return seq[self.randrange(len(seq))]
+
+  def shuffle(self, items):
+    random = self.random
+    for i in range(len(items) - 1, 0, -1):
+      j = int(random() * (i + 1))
+      items[i], items[j] = items[j], items[i]
+
+  def gauss(self):
+    u = 1.0 - self.random()
+    return math.sqrt(-2.0 * math.log(u)) * math.cos(2.0 * math.pi * self.random())
+
+  def binomial(self, n, p):
+    """How many of n tries with chance p succeed, exactly binomial, a few draws for any n"""
+    if n <= 0 or p <= 0.0:
+      return 0
+    if p >= 1.0:
+      return n
+    if p > 0.5:
+      return n - self.binomial(n, 1.0 - p)
+
+    if n * p <= 30:
+      # walk up the cumulative distribution, about mean steps
+      odds = p / (1.0 - p)
+      f = (1.0 - p) ** n
+      u = self.random()
+      k = 0
+      while u > f and k < n:
+        u -= f
+        k += 1
+        f *= odds * (n - k + 1) / k
+      return k
+    return self.btpe(n, p)
+
+  def btpe(self, n, p):
+    """Binomial by triangle, parallelogram and exponential rejection (Kachitvichyanukul
+    and Schmeiser 1988), for n * p over 30 and p up to 0.5; as numpy does it.
+    """
+    q = 1.0 - p
+    nrq = n * p * q
+    fm = n * p + p
+    m = int(math.floor(fm))
+    p1 = math.floor(2.195 * math.sqrt(nrq) - 4.6 * q) + 0.5
+    xm = m + 0.5
+    xl = xm - p1
+    xr = xm + p1
+    c = 0.134 + 20.5 / (15.3 + m)
+    a = (fm - xl) / (fm - xl * p)
+    laml = a * (1.0 + a / 2.0)
+    a = (xr - fm) / (xr * q)
+    lamr = a * (1.0 + a / 2.0)
+    p2 = p1 * (1.0 + 2.0 * c)
+    p3 = p2 + c / laml
+    p4 = p3 + c / lamr
+
+    while True:
+      u = self.random() * p4
+      v = self.random()
+      if u <= p1:
+        # triangle, accepted straight away
+        return int(math.floor(xm - p1 * v + u))
+
+      if u <= p2:
+        # parallelogram
+        x = xl + (u - p1) / c
+        v = v * c + 1.0 - abs(m - x + 0.5) / p1
+        if v > 1.0:
+          continue
+        y = int(math.floor(x))
+      elif u <= p3:
+        # left exponential tail
+        if v == 0.0:
+          continue
+        y = int(math.floor(xl + math.log(v) / laml))
+        if y < 0:
+          continue
+        v = v * (u - p2) * laml
+      else:
+        # right exponential tail
+        if v == 0.0:
+          continue
+        y = int(math.floor(xr - math.log(v) / lamr))
+        if y > n:
+          continue
+        v = v * (u - p3) * lamr
+
+      k = abs(y - m)
+      if k <= 20 or k >= nrq / 2.0 - 1:
+        # the ratio f(y) / f(m) term by term
+        s = p / q
+        a = s * (n + 1)
+        f = 1.0
+        if m < y:
+          for i in range(m + 1, y + 1):
+            f *= a / i - s
+        elif m > y:
+          for i in range(y + 1, m + 1):
+            f /= a / i - s
+        if v <= f:
+          return y
+        continue
+
+      # squeeze on log f(y) / f(m), then the bound with Stirling's series
+      rho = (k / nrq) * ((k * (k / 3.0 + 0.625) + 0.1666666666666) / nrq + 0.5)
+      t = -k * k / (2.0 * nrq)
+      alpha = math.log(v)
+      if alpha < t - rho:
+        return y
+      if alpha > t + rho:
+        continue
+      x1 = y + 1.0
+      f1 = m + 1.0
+      z = n + 1.0 - m
+      w = n - y + 1.0
+      if alpha <= (xm * math.log(f1 / x1) + (n - m + 0.5) * math.log(z / w) +
+                   (y - m) * math.log(w * p / (x1 * q)) +
+                   stirling(f1) + stirling(z) + stirling(x1) + stirling(w)):
+        return y
+
+  def split(self, n, bins):
+    """Counts of n units each dropped into one of bins at random (multinomial)"""
+    counts = [0] * bins
+    if n <= bins:
+      # a draw per unit is fewer than a binomial per bin
+      for unit in range(n):
+        counts[self.randrange(bins)] += 1
+      return counts
+    for b in range(bins - 1, 0, -1):
+      c = self.binomial(n, 1.0 / (b + 1))
+      counts[bins - 1 - b] = c
+      n -= c
+      if not n:
+        return counts
+    counts[-1] = n
+    return counts
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+"""Record runs tick by tick and play them back.
+
+A recording is a header (model, w, h) followed by one record per tick:
+every keyframes ticks the whole planes, otherwise only the cells that
+changed since the tick before, as the gaps between their indices and their
+new type, pressure and heat.  Each record is zlib compressed on its own, so
+a foam world that only changes along its edge costs a few bytes a tick.
+
+  recorder = Recorder(gg, 'run.rec')
+  ... gg.update(); recorder.record() ...
+
+  replay = Replay('run.rec')      builds a grid of the recorded model
+  replay.seek(500)                from the keyframe before, forward
+  replay.step(); replay.step(-1)
+
+Seeking goes to the last keyframe at or before the tick and applies the
+records after it, so it never reads more than keyframes records.  Needs
+numpy.
+
+  python gasrecord.py run.rec     watch a recording
+"""
+import bisect
+import struct
+import sys
+import zlib
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+import gasfile
+import gasgrid
+
+MAGIC = b'GASR'
+# version 1 recorded pressure as 32 bits, 2 as 64
+VERSION = 2
+HEADER = struct.Struct('<4sH16sIII')
+# kind, tick, length of the compressed payload
+RECORD = struct.Struct('<BqI')
+KEY = 1
+DELTA = 2
+# how each version stores types, pressure and heat
+DTYPES = {1: ('u1', '<i4', '<i2'), 2: ('u1', '<i8', '<i2')}
+
+
+def available():
+  return numpy is not None
+
+
+def planes(gg):
+  return (numpy.frombuffer(gg.types, dtype=numpy.uint8),
+          numpy.frombuffer(gg.pressure, dtype=gasgrid.PRESSURE),
+          numpy.frombuffer(gg.heat, dtype=numpy.int16))
+
+
+class Recorder(object):
+  """Appends a record of gg to path every time record() is called"""
+
+  def __init__(self, gg, path, keyframes=250, model=None):
+    if not gg.dense:
+      raise ValueError("only grids with flat planes can be recorded")
+    self.gg = gg
+    self.keyframes = keyframes
+    self.file = open(path, 'wb')
+    self.file.write(HEADER.pack(MAGIC, VERSION, (model or gasfile.modelOf(gg)).encode('ascii'),
+                                gg.w, gg.h, keyframes))
+    # nothing left in the buffer for a forked simulation process to write again
+    self.file.flush()
+    self.last = None
+    self.count = 0
+
+  def record(self):
+    self.gg.settle()
+    current = planes(self.gg)
+    if self.count % self.keyframes == 0:
+      self.last = [plane.copy() for plane in current]
+      self.write(KEY, b''.join(plane.astype(dtype).tostring() for plane, dtype in zip(current, DTYPES[VERSION])))
+    else:
+      changed = numpy.zeros(len(current[0]), dtype=bool)
+      for plane, last in zip(current, self.last):
+        changed |= plane != last
+      idx = numpy.flatnonzero(changed)
+      gaps = idx.copy()
+      gaps[1:] = numpy.diff(idx)
+      payload = [struct.pack('<I', len(idx)), gaps.astype('<u4').tostring()]
+      for plane, last, dtype in zip(current, self.last, DTYPES[VERSION]):
+        last[idx] = plane[idx]
+        payload.append(plane[idx].astype(dtype).tostring())
+      self.write(DELTA, b''.join(payload))
+    self.count += 1
+
+  def write(self, kind, payload):
+    payload = zlib.compress(payload)
+    self.file.write(RECORD.pack(kind, self.gg.tick, len(payload)))
+    self.file.write(payload)
+    # a simulation process never gets to close us
+    self.file.flush()
+
+  def close(self):
+    self.file.close()
+
+
+class Replay(object):
+  """A recording opened for playback into a grid of its model"""
+
+  def __init__(self, path, gg=None):
+    self.file = open(path, 'rb')
+    magic, version, model, w, h, self.keyframes = HEADER.unpack(self.file.read(HEADER.size))
+    self.version = version
+    if magic != MAGIC:
+      raise ValueError("not a gas recording")
+    if version > VERSION:
+      raise ValueError("gas recording version %d, this reads up to %d" % (version, VERSION))
+    self.model = model.rstrip(b'\0').decode('ascii')
+    self.gg = gg or gasfile.grid(self.model, w, h)
+
+    # (kind, tick, offset, length) of every record, and which ones are keyframes
+    self.records = []
+    self.keys = []
+    offset = HEADER.size
+    while True:
+      head = self.file.read(RECORD.size)
+      if len(head) < RECORD.size:
+        break
+      kind, tick, length = RECORD.unpack(head)
+      offset += RECORD.size
+      if kind == KEY:
+        self.keys.append(len(self.records))
+      self.records.append((kind, tick, offset, length))
+      offset += length
+      self.file.seek(offset)
+    if not self.keys:
+      raise ValueError("gas recording without a keyframe")
+
+    self.position = -1
+    self.seek(0)
+
+  def __len__(self):
+    return len(self.records)
+
+  def tick(self):
+    return self.records[self.position][1]
+
+  def seek(self, k):
+    """Show record k, clamped to the recording"""
+    k = min(max(k, 0), len(self.records) - 1)
+    key = self.keys[bisect.bisect_right(self.keys, k) - 1]
+    # carry on from here when no keyframe lies in between, it's less to read
+    start = self.position + 1 if key <= self.position <= k else key
+    for j in range(start, k + 1):
+      self.apply(j)
+    self.position = k
+
+  def step(self, n=1):
+    self.seek(self.position + n)
+
+  def apply(self, k):
+    kind, tick, offset, length = self.records[k]
+    self.file.seek(offset)
+    payload = zlib.decompress(self.file.read(length))
+    current = planes(self.gg)
+    dtypes = [numpy.dtype(dtype) for dtype in DTYPES[self.version]]
+    n = len(current[0])
+    if kind == KEY:
+      at = 0
+      for plane, dtype in zip(current, dtypes):
+        plane[:] = numpy.frombuffer(payload, dtype, n, at)
+        at += dtype.itemsize * n
+      self.gg.invalidate()
+    else:
+      count = struct.unpack('<I', payload[:4])[0]
+      at = 4
+      idx = numpy.cumsum(numpy.frombuffer(payload, '<u4', count, at)).astype(numpy.intp)
+      at += 4 * count
+      for plane, dtype in zip(current, dtypes):
+        plane[idx] = numpy.frombuffer(payload, dtype, count, at)
+        at += dtype.itemsize * count
+      self.gg.markDirty(idx.tolist())
+    # the heat read is that of this tick
+    self.gg.tick = tick
+    self.gg.retally()
+
+  def close(self):
+    self.file.close()
+
+
+def main():
+  import pygame
+  from pygame.locals import QUIT, KEYDOWN, K_ESCAPE, K_SPACE, K_LEFT, K_RIGHT, K_PAGEUP, K_PAGEDOWN, K_HOME, K_END
+
+  if len(sys.argv) < 2:
+    print("usage: gasrecord.py recording")
+    return
+  replay = Replay(sys.argv[1])
+  gg = replay.gg
+
+  pygame.init()
+  font = pygame.font.SysFont("Arial", 15)
+  screen = pygame.display.set_mode((gg.w * gg.cellSize, gg.h * gg.cellSize))
+  clock = pygame.time.Clock()
+
+  playing = True
+  running = True
+  overlay = []
+  while running:
+    for event in pygame.event.get():
+      if event.type == QUIT:
+        running = False
+      elif event.type == KEYDOWN:
+        if event.key == K_ESCAPE:
+          running = False
+        elif event.key == K_SPACE:
+          playing = not playing
+        elif event.key == K_RIGHT:
+          replay.step()
+        elif event.key == K_LEFT:
+          replay.step(-1)
+        elif event.key == K_PAGEDOWN:
+          replay.step(replay.keyframes)
+        elif event.key == K_PAGEUP:
+          replay.step(-replay.keyframes)
+        elif event.key == K_HOME:
+          replay.seek(0)
+        elif event.key == K_END:
+          replay.seek(len(replay) - 1)
+
+    if playing and replay.position < len(replay) - 1:
+      replay.step()
+
+    gg.uncover(screen, overlay)
+    rects = gg.render(screen)
+    text = "Tick %d  record %d/%d%s  (space, arrows, page up/down, home/end)" % (
+      replay.tick(), replay.position + 1, len(replay), "" if playing else "  paused")
+    overlay = [screen.blit(font.render(text, True, (255, 255, 255)), (5, 5))]
+    pygame.display.update(rects + overlay)
+    clock.tick(30)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,100 @@
+"""Lookup table rendering for the gas experiments.
+
+Instead of asking every cell for its color and filling a rect per cell, the
+color of every (type, heat, pressure) combination a model can show is worked
+out once.  Each frame the planes are turned into table indices with numpy,
+written into a surface of one pixel per cell and scaled up to cellSize in one
+go.  Needs numpy, GameGrid.render falls back to per cell fills without it.
+"""
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+try:
+  import pygame
+  import pygame.surfarray
+except ImportError:
+  pygame = None
+
+import gasgrid
+
+def available():
+  return numpy is not None and pygame is not None
+
+
+class Palette(object):
+  """Cell colors for each type code, heat bin and pressure bin.
+
+  color(code, heat, pressure) gives the color the model draws for those
+  values.  heat and pressure are (values, quantize) pairs: the plane value
+  each bin stands for, and a numpy function turning plane values into bin
+  numbers.  Leave one out when the colors do not depend on it.
+  """
+
+  def __init__(self, color, heat=None, pressure=None):
+    self.color = color
+    self.heatValues, self.heatBin = heat or ([0], None)
+    self.pressureValues, self.pressureBin = pressure or ([0], None)
+    self.enabled = available()
+    self.lut = None
+    self.small = None
+    self.large = None
+    self.lines = None
+
+  def build(self, types):
+    """The mapped color of every table entry, as a flat uint32 array"""
+    surface = pygame.Surface((1, 1), 0, 32)
+    lut = []
+    for code in range(types):
+      for heat in self.heatValues:
+        for pressure in self.pressureValues:
+          lut.append(surface.map_rgb(self.color(code, heat, pressure)))
+    return numpy.array(lut, dtype=numpy.uint32)
+
+  def indices(self, gg):
+    """Table index of every cell, in plane order"""
+    t = numpy.frombuffer(gg.types, dtype=numpy.uint8)
+    index = t.astype(numpy.intp)
+
+    index *= len(self.heatValues)
+    if self.heatBin is not None:
+      index += self.heatBin(numpy.frombuffer(gg.heat, dtype=numpy.int16))
+
+    index *= len(self.pressureValues)
+    if self.pressureBin is not None:
+      index += self.pressureBin(numpy.frombuffer(gg.pressure, dtype=gasgrid.PRESSURE))
+    return index
+
+  def surfaces(self, gg):
+    w, h, cs = gg.w, gg.h, gg.cellSize
+    if self.small is None or self.small.get_size() != (w, h):
+      self.small = pygame.Surface((w, h), 0, 32)
+      self.large = pygame.Surface((w * cs, h * cs), 0, 32)
+
+      # the one pixel gap to the right of and below every cell
+      self.lines = pygame.Surface((w * cs, h * cs), 0, 32)
+      self.lines.fill((255, 0, 255))
+      self.lines.set_colorkey((255, 0, 255))
+      for x in range(cs - 1, w * cs, cs):
+        self.lines.fill((0, 0, 0), (x, 0, 1, h * cs))
+      for y in range(cs - 1, h * cs, cs):
+        self.lines.fill((0, 0, 0), (0, y, w * cs, 1))
+    return self.small, self.large
+
+  def render(self, gg, surface):
+    """Draw the whole grid onto surface, returns the rect it covers"""
+    if self.lut is None:
+      self.lut = self.build(len(gg.cellTypes))
+
+    small, large = self.surfaces(gg)
+    pixels = self.lut[self.indices(gg)].reshape(gg.h, gg.w)
+    pygame.surfarray.blit_array(small, pixels.T)
+    pygame.transform.scale(small, large.get_size(), large)
+    large.blit(self.lines, (0, 0))
+    return surface.blit(large, (0, 0))
+
+
+def clamped(low, high):
+  """Bins for every plane value from low to high, anything outside goes to the nearest end"""
+  return list(range(low, high + 1)), lambda values: numpy.clip(values, low, high) - low
@@ -0,0 +1,234 @@
+"""Run the numpy gas kernel over several processes.
+
+The grid is cut into bands of whole rows, one per worker process.  The
+first step hands the grid's pressure and heat planes over to shared memory
+(they stay there, the grid reads and writes them in place like the
+RawArrays gasworker gives it); only the types are copied in and out every
+tick, the grid needs them as a bytearray.  Each worker keeps a copy of its
+band plus HALO rows above and below from tick to tick, steps that window
+with gaskernel and writes back only the cells of its band it wrote.  After
+every spread step the workers meet at a barrier and read just the halo rows
+the neighbors wrote, so the halos never drift more than one step out of
+date.  The band itself is only read again when gg.writes shows the grid was
+written outside the steps.  Each worker reports the cells of its band that
+changed, for the grid to redraw.
+
+Random numbers are keyed by world cell index (gaskernel.Window.base), so a
+run gives exactly the planes gaskernel.spindlyStep gives for the same seed,
+whatever the number of workers:
+
+  tiles = Tiles(gg.w, gg.h, 4)
+  tiles.step(gg)
+  tiles.close()
+"""
+import multiprocessing
+import multiprocessing.util
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+import gasgrid
+import gaskernel
+import gasrandom
+
+# rows of neighbors a worker copies on each side of its band.  One spread
+# step reads the claims of sources up to 8 rows away (4 rounds of 2 rows).
+HALO = 12
+
+
+class Barrier(object):
+  """multiprocessing.Barrier is python 3 only"""
+
+  def __init__(self, parties):
+    self.parties = parties
+    self.condition = multiprocessing.Condition()
+    self.count = multiprocessing.RawValue('i', 0)
+    self.generation = multiprocessing.RawValue('i', 0)
+
+  def wait(self):
+    with self.condition:
+      generation = self.generation.value
+      self.count.value += 1
+      if self.count.value == self.parties:
+        self.count.value = 0
+        self.generation.value += 1
+        self.condition.notify_all()
+      else:
+        while generation == self.generation.value:
+          self.condition.wait()
+
+
+class Shared(object):
+  """The planes of a w x h grid in shared memory, plus the pressure each cell pushes next step"""
+
+  def __init__(self, w, h, workers):
+    n = w * h
+    self.w = w
+    self.h = h
+    self.raw = [multiprocessing.RawArray(code, n) for code in ('B', gasgrid.PRESSURE, 'h', gasgrid.PRESSURE)]
+    # set by each worker that still has pressure to push
+    self.flags = multiprocessing.RawArray('i', workers)
+
+  def views(self):
+    """numpy views of types, pressure, heat and amount, made again in each process"""
+    dtypes = (numpy.uint8, gasgrid.PRESSURE, numpy.int16, gasgrid.PRESSURE)
+    return [numpy.frombuffer(raw, dtype=dtype) for raw, dtype in zip(self.raw, dtypes)]
+
+
+def bands(h, workers):
+  """(first, end) rows of each band, as even as they go"""
+  workers = max(1, min(workers, h))
+  return [(h * k // workers, h * (k + 1) // workers) for k in range(workers)]
+
+
+def work(shared, k, band, barrier, conn):
+  """Worker process k, stepping its band for every tick the pipe sends"""
+  t, p, heat, amount = shared.views()
+  flags = numpy.frombuffer(shared.flags, dtype=numpy.int32)
+  w = shared.w
+  top = max(0, band[0] - HALO) * w
+  bottom = min(shared.h, band[1] + HALO) * w
+  # the owned rows, in window and in world cell indices
+  own = slice(band[0] * w - top, band[1] * w - top)
+  world = slice(band[0] * w, band[1] * w)
+
+  # window and world slices of the rows above and below the band
+  halos = [(slice(0, own.start), slice(top, world.start)),
+           (slice(own.stop, bottom - top), slice(world.stop, bottom))]
+
+  # kept from tick to tick: nobody else writes the owned rows, unless the
+  # grid was written outside a step and the tick comes in fresh
+  n = bottom - top
+  win = gaskernel.Window(numpy.zeros(n, numpy.uint8), numpy.zeros(n, gasgrid.PRESSURE),
+                         numpy.zeros(n, numpy.int16), w, None, 0, top)
+
+  def owned(idx):
+    return (idx >= own.start) & (idx < own.stop)
+
+  while True:
+    message = conn.recv()
+    if message is None:
+      break
+    seed, tick, heatLoss, newHeat, fresh = message
+
+    if win.rng is None or win.rng.seed != seed:
+      win.rng = gasrandom.Streams(seed)
+    win.tick = tick
+    win.touched = []
+    if fresh:
+      win.t[:] = t[top:bottom]
+      win.p[:] = p[top:bottom]
+      win.heat[:] = heat[top:bottom]
+    else:
+      for mine, theirs in halos:
+        win.t[mine] = t[theirs]
+        win.p[mine] = p[theirs]
+        win.heat[mine] = heat[theirs]
+    gas = win.t == gasgrid.GAS
+    idx, push = gaskernel.sources(win, gas)
+    barrier.wait()
+
+    step = 0
+    # world indices of the owned cells with pressure in amount
+    pushing = idx[:0]
+    while True:
+      mark = len(win.touched)
+      idx, push = gaskernel.forwardStep(win, gas, idx, push, step, newHeat)
+      step += 1
+
+      # write back the owned cells this step wrote, and what they push next
+      written = numpy.unique(numpy.concatenate(win.touched[mark:]))
+      written = written[owned(written)]
+      t[written + top] = win.t[written]
+      p[written + top] = win.p[written]
+      heat[written + top] = win.heat[written]
+      amount[pushing] = 0
+      pushing = idx[owned(idx)] + top
+      amount[pushing] = push[owned(idx)]
+      flags[k] = len(pushing) > 0
+      barrier.wait()
+
+      if not flags.any():
+        break
+      for mine, theirs in halos:
+        win.t[mine] = t[theirs]
+        win.p[mine] = p[theirs]
+        win.heat[mine] = heat[theirs]
+      # in row order, like flatnonzero over the whole window
+      (up, upWorld), (down, downWorld) = halos
+      idx = numpy.concatenate([numpy.flatnonzero(amount[upWorld]) + up.start, pushing - top,
+                               numpy.flatnonzero(amount[downWorld]) + down.start])
+      push = amount[idx + top]
+      # nobody writes the next step before everyone has read this one
+      barrier.wait()
+
+    cooled = win.heat[own]
+    hot = gas[own] & (cooled > 0)
+    cooled[hot] -= heatLoss
+    heat[world][hot] = cooled[hot]
+    changed = numpy.unique(numpy.concatenate(win.touched))
+    changed = numpy.union1d(changed[owned(changed)] - own.start, numpy.flatnonzero(hot))
+    conn.send(changed + world.start)
+  conn.close()
+
+
+class Tiles(object):
+  """Worker processes sharing the spindly kernel of w x h grids"""
+
+  def __init__(self, w, h, workers=2):
+    self.w = w
+    self.h = h
+    self.bands = bands(h, workers)
+    self.shared = Shared(w, h, len(self.bands))
+    self.barrier = Barrier(len(self.bands))
+    # gg.writes after the last step, None before the first
+    self.writes = None
+    self.pipes = []
+    self.processes = []
+    for k, band in enumerate(self.bands):
+      conn, child = multiprocessing.Pipe()
+      process = multiprocessing.Process(target=work, args=(self.shared, k, band, self.barrier, child))
+      process.daemon = True
+      process.start()
+      self.pipes.append(conn)
+      self.processes.append(process)
+    # stop the workers before multiprocessing terminates daemons at exit,
+    # SIGTERM does not get through once pygame has its handler in
+    multiprocessing.util.Finalize(self, self.close, exitpriority=10)
+
+  def step(self, gg, heatLoss=5, newHeat=100):
+    """gaskernel.spindlyStep on gg, spread over the workers"""
+    types, pressure, heat = self.shared.raw[:3]
+    if gg.pressure is not pressure or gg.heat is not heat:
+      self.adopt(gg)
+    gasgrid.copyPlane(types, gg.types)
+
+    # the workers reload their whole windows after any write they did not make
+    fresh = gg.writes != self.writes
+    for conn in self.pipes:
+      conn.send((gg.rng.seed, gg.tick, heatLoss, newHeat, fresh))
+    changed = [conn.recv() for conn in self.pipes]
+
+    gasgrid.copyPlane(gg.types, types)
+    gg.markDirty(numpy.concatenate(changed).tolist())
+    gg.retally()
+    self.writes = gg.writes
+
+  def adopt(self, gg):
+    """Move the pressure and heat of gg into shared memory, gg uses them from there on"""
+    types, pressure, heat = self.shared.raw[:3]
+    gasgrid.copyPlane(pressure, gg.pressure)
+    gasgrid.copyPlane(heat, gg.heat)
+    gg.pressure = pressure
+    gg.heat = heat
+    self.writes = None
+
+  def close(self):
+    for conn in self.pipes:
+      conn.send(None)
+    for process in self.processes:
+      process.join()
+    self.pipes = []
+    self.processes = []
@@ -0,0 +1,199 @@
+"""Run a gas model in its own process, apart from the window.
+
+The simulation process owns the GameGrid.  After every batch of ticks it
+copies the planes into one of two shared buffers (Frames), with the tally
+totals, and publishes its number; the window process points its own grid at
+the pressure and heat of the latest published buffer and renders straight
+from shared memory (the types are copied back, the grid needs them as a
+bytearray), taking the totals as they are instead of recounting them.
+Clicks and keys go the other way as small fixed size commands through a
+ring (Commands).
+
+Frames is a seqlock with two buffers: the writer says which frame it has
+started before touching a buffer and publishes it once done, so a reader can
+tell afterwards whether the buffer it used was overwritten meanwhile.
+
+python 2 has no multiprocessing.shared_memory, the buffers are RawArrays
+created before the fork.  The simulation process is not a daemon so it can
+start processes of its own (gastiles); close() stops it, and the window
+raises instead of showing the last frame forever if it dies on its own.
+"""
+import collections
+import ctypes
+import multiprocessing
+import os
+import time
+
+import gasgrid
+
+# planes copied into each frame, with their RawArray codes
+PLANES = (('types', 'B'), ('pressure', gasgrid.PRESSURE), ('heat', 'h'))
+# type codes whose tally totals go with each frame
+CODES = 4
+# per frame: count and pressure of each code, coldest and hottest gas
+TOTALS = 2 * CODES + 2
+
+
+class Frames(object):
+  """Two shared copies of the planes of a w x h grid, written by one process"""
+
+  def __init__(self, w, h):
+    n = w * h
+    self.buffers = [[multiprocessing.RawArray(code, n) for name, code in PLANES] for b in range(2)]
+    # frame started, frame published, the tick of each buffer, then the
+    # tally totals of each buffer so the window does not recount them
+    self.counters = multiprocessing.RawArray('l', 4 + 2 * TOTALS)
+
+  def published(self):
+    return self.counters[1]
+
+  def publish(self, gg):
+    """Copy the planes of gg into the buffer the readers are not using"""
+    gg.settle()
+    frame = self.counters[1] + 1
+    self.counters[0] = frame
+    for (name, code), raw in zip(PLANES, self.buffers[frame % 2]):
+      ctypes.memmove(raw, gasgrid.address(getattr(gg, name)), ctypes.sizeof(raw))
+    self.counters[2 + frame % 2] = gg.tick
+    if gg.tally is not None:
+      tally = gg.tally
+      k = 4 + frame % 2 * TOTALS
+      pressure = [gasgrid.saturate(p) for p in tally.pressure[:CODES]]
+      self.counters[k:k + TOTALS] = tally.counts[:CODES] + pressure + list(tally.heatRange() or (1, 0))
+    self.counters[1] = frame
+
+  def view(self, gg):
+    """Point the planes of gg at the latest frame, returns its number (0 before the first)"""
+    frame = self.counters[1]
+    if frame:
+      # the frames come settled, the window leaves the heat as it is
+      if gg.cooling is not None and not gg.cooling.paused:
+        gg.cooling.pause()
+      types, pressure, heat = self.buffers[frame % 2]
+      gasgrid.copyPlane(gg.types, types)
+      gg.pressure = pressure
+      gg.heat = heat
+      gg.tick = self.counters[2 + frame % 2]
+      gg.writes += 1
+      if gg.regions is not None:
+        gg.regions.reset()
+      if gg.tally is not None:
+        k = 4 + frame % 2 * TOTALS
+        totals = self.counters[k:k + TOTALS]
+        coldest, hottest = totals[-2:]
+        gg.tally.assume(totals[:CODES], totals[CODES:2 * CODES], (coldest, hottest) if coldest <= hottest else None)
+    return frame
+
+  def intact(self, frame):
+    """Whether the buffer of frame was left alone while it was being read"""
+    return self.counters[0] < frame + 2
+
+
+class Commands(object):
+  """Ring of commands of a few ints, one process pushes and another pops, no locks"""
+
+  def __init__(self, size=256, fields=4):
+    self.size = size
+    self.fields = fields
+    self.slots = multiprocessing.RawArray('i', size * fields)
+    # only the reader moves head and only the writer moves tail
+    self.head = multiprocessing.RawValue('l', 0)
+    self.tail = multiprocessing.RawValue('l', 0)
+
+  def push(self, *command):
+    """Queue a command, False when the ring is full"""
+    tail = self.tail.value
+    if tail - self.head.value == self.size:
+      return False
+    k = tail % self.size * self.fields
+    command = (tuple(command) + (0,) * self.fields)[:self.fields]
+    self.slots[k:k + self.fields] = command
+    self.tail.value = tail + 1
+    return True
+
+  def pop(self):
+    head = self.head.value
+    if head == self.tail.value:
+      return None
+    k = head % self.size * self.fields
+    command = tuple(self.slots[k:k + self.fields])
+    self.head.value = head + 1
+    return command
+
+  def drain(self):
+    while True:
+      command = self.pop()
+      if command is None:
+        break
+      yield command
+
+
+# the command that stops the simulation process, models use codes from 1
+QUIT = 0
+
+
+def serve(gg, frames, commands, apply, advance, idle=0.005):
+  """The simulation process: apply commands, run due ticks, publish"""
+  parent = os.getppid()
+  frames.publish(gg)
+  while os.getppid() == parent:
+    changed = False
+    for command in commands.drain():
+      if command[0] == QUIT:
+        return
+      apply(gg, *command)
+      changed = True
+    if advance() or changed:
+      frames.publish(gg)
+    else:
+      time.sleep(idle)
+
+
+class Simulation(object):
+  """A simulation process for gg, seen from the window.
+
+  apply(gg, *command) carries out a command sent with send, advance() runs
+  the ticks that are due and returns how many ran.  Both are called in the
+  simulation process, on its copy of gg.
+  """
+
+  def __init__(self, gg, apply, advance, fields=4):
+    self.frames = Frames(gg.w, gg.h)
+    self.commands = Commands(fields=fields)
+    self.process = multiprocessing.Process(target=serve, args=(gg, self.frames, self.commands, apply, advance))
+    self.process.start()
+    self.closed = False
+    # (time, tick) of the frames seen over the last second, for the rate
+    self.recent = collections.deque()
+
+  def send(self, *command):
+    return self.commands.push(*command)
+
+  def alive(self):
+    """Raise if the simulation process has gone away without being closed"""
+    if not self.closed and not self.process.is_alive():
+      raise RuntimeError("simulation process died (exit code %s)" % self.process.exitcode)
+
+  def view(self, gg):
+    self.alive()
+    frame = self.frames.view(gg)
+    now = time.time()
+    self.recent.append((now, gg.tick))
+    while self.recent[0][0] < now - 1.0:
+      self.recent.popleft()
+    return frame
+
+  def rate(self):
+    (first, start), (last, end) = self.recent[0], self.recent[-1]
+    return (end - start) / (last - first) if last > first else 0.0
+
+  def describe(self):
+    return "Ticks/s: %d (worker)" % self.rate()
+
+  def close(self):
+    if self.closed:
+      return
+    self.closed = True
+    while self.process.is_alive() and not self.commands.push(QUIT):
+      time.sleep(0.001)
+    self.process.join()
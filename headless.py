@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""Run one of the gas models without a window.
+
+A scenario is a small JSON description of the world:
+
+  {
+    "model": "spindly",            module name of the experiment
+    "width": 160, "height": 160,
+    "ticks": 200,                  how many steps to run
+    "every": 10,                   print metrics every n ticks (0: only at the end)
+    "seed": 1,
+    "gas": [[80, 80, 400]],        x, y and optionally the pressure
+    "hard": [[10, 10], [20, 0, 1, 40]],  single cells or x, y, w, h blocks
+    "options": {"vectorized": true}      module globals to set first
+                                   ({"sparse": true} for chunked worlds,
+                                   which cannot be recorded or saved)
+    "load": "maze.gas",            start from a saved world instead (gasfile)
+    "save": "after.gas",           save the world at the end
+    "record": "run.rec",           record every tick (gasrecord)
+    "profile": "run.csv"           tick timings and counters, .csv or .json
+  }
+
+The model is stepped as fast as it goes and every sample is printed as a
+JSON line with the same numbers worldData() shows in the overlay.
+
+  python headless.py scenario.json
+  python headless.py --model py_gass --ticks 50 --gas 32,32
+"""
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+
+import gasfile
+import gasgrid
+import gasprofile
+import gasrecord
+
+# the GameGrid method that advances each model by one tick
+MODELS = {
+  'spindly': 'update',
+  'py_gass': 'updateGas',
+  'py_gass2': 'updateGas',
+  'py_gass3': 'update',
+  'py_gass_brady1': 'update',
+}
+
+DEFAULTS = {
+  'model': 'spindly',
+  'width': 64,
+  'height': 64,
+  'ticks': 100,
+  'every': 0,
+  'seed': 0,
+  'gas': [],
+  'hard': [],
+  'options': {},
+  'load': None,
+  'save': None,
+  'record': None,
+  'profile': None,
+}
+
+
+def scenario(description):
+  s = dict(DEFAULTS)
+  if description.get('load'):
+    # the model the world was saved from, unless told otherwise
+    s['model'] = gasfile.header(description['load']).model
+  s.update(description)
+  if not s['model'] in MODELS:
+    raise ValueError("unknown model %r, pick one of %s" % (s['model'], ", ".join(sorted(MODELS))))
+  return s
+
+
+class Quiet(object):
+  """Swallow the debug prints some models do on every step"""
+
+  def __enter__(self):
+    self.stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+
+  def __exit__(self, *args):
+    sys.stdout.close()
+    sys.stdout = self.stdout
+
+
+def build(s):
+  """Import the model and set up its grid, returns (module, grid, step)"""
+  with Quiet():
+    module = importlib.import_module(s['model'])
+
+  for name, value in s['options'].items():
+    setattr(module, name, value)
+
+  if s['load']:
+    head = gasfile.header(s['load'])
+    s['width'], s['height'] = head.w, head.h
+  w = s['width']
+  h = s['height']
+  gg = gasfile.grid(s['model'], w, h)
+  gg.reseed(s['seed'])
+  if s['load']:
+    gasfile.load(s['load'], gg)
+  for block in s['hard']:
+    x, y = block[0], block[1]
+    bw, bh = (block[2], block[3]) if len(block) > 2 else (1, 1)
+    for yy in range(y, min(y + bh, h)):
+      for xx in range(x, min(x + bw, w)):
+        module.addHard(gg, xx, yy)
+
+  for gas in s['gas']:
+    module.addGas(gg, *gas)
+
+  return module, gg, getattr(gg, MODELS[s['model']])
+
+
+def metrics(gg):
+  return {
+    "pressure": gg.pressureOf(gasgrid.GAS),
+    "volume": gg.countOf(gasgrid.GAS),
+    "foam": gg.countOf(gasgrid.AMBER),
+    "hard": gg.countOf(gasgrid.HARD),
+  }
+
+
+def run(s, out=sys.stdout, quiet=True):
+  s = scenario(s)
+  module, gg, step = build(s)
+  if not gg.dense:
+    # found out before the run rather than after it
+    for name in ('record', 'save'):
+      if s[name]:
+        raise ValueError("%s needs a grid with flat planes, not the sparse one options.sparse makes" % name)
+
+  def sample(tick, elapsed):
+    m = metrics(gg)
+    m["tick"] = tick
+    m["elapsed"] = round(elapsed, 6)
+    m["ticksPerSecond"] = round(tick / elapsed, 2) if elapsed > 0 else None
+    out.write(json.dumps(m, sort_keys=True) + "\n")
+    return m
+
+  recorder = None
+  if s['record']:
+    recorder = gasrecord.Recorder(gg, s['record'], model=s['model'])
+    recorder.record()
+
+  profile = gasprofile.Profile(window=max(s['ticks'], 1))
+  if s['profile']:
+    profile.enabled = True
+    profile.instrument(gg)
+
+  elapsed = 0.0
+  for tick in range(1, s['ticks'] + 1):
+    start = time.time()
+    if quiet:
+      with Quiet():
+        profile.run('tick', step)
+    else:
+      profile.run('tick', step)
+    elapsed += time.time() - start
+    if recorder:
+      profile.run('record', recorder.record)
+    profile.frame()
+
+    if s['every'] and tick % s['every'] == 0 and tick != s['ticks']:
+      sample(tick, elapsed)
+
+  if s['save']:
+    gasfile.save(gg, s['save'], s['model'])
+  if recorder:
+    recorder.close()
+  if s['profile']:
+    profile.export(s['profile'])
+  return sample(s['ticks'], elapsed)
+
+
+def point(text):
+  return [int(v) for v in text.split(',')]
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Step a gas model without a window")
+  parser.add_argument('scenario', nargs='?', help="scenario JSON file")
+  parser.add_argument('--model', choices=sorted(MODELS))
+  parser.add_argument('--width', type=int)
+  parser.add_argument('--height', type=int)
+  parser.add_argument('--ticks', type=int)
+  parser.add_argument('--every', type=int)
+  parser.add_argument('--seed', type=int)
+  parser.add_argument('--gas', type=point, action='append', help="x,y[,pressure]")
+  parser.add_argument('--hard', type=point, action='append', help="x,y[,w,h]")
+  parser.add_argument('--load', help="saved world to start from")
+  parser.add_argument('--save', help="save the world here at the end")
+  parser.add_argument('--record', help="record every tick here")
+  parser.add_argument('--profile', help="save tick timings and counters here, .csv or .json")
+  parser.add_argument('--verbose', action='store_true', help="let the models print")
+  args = parser.parse_args()
+
+  s = {}
+  if args.scenario:
+    with open(args.scenario) as f:
+      s = json.load(f)
+
+  for name in ('model', 'width', 'height', 'ticks', 'every', 'seed', 'gas', 'hard', 'load', 'save', 'record', 'profile'):
+    if getattr(args, name) is not None:
+      s[name] = getattr(args, name)
+
+  run(s, quiet=not args.verbose)
+
+if __name__ == "__main__":
+  main()
@@ -1,14 +1,15 @@
 #!/usr/bin/env python
 import random
 import pygame
+import gasgrid
+import gasrender
 from pygame.locals import *
-pygame.init()
-
-Font = pygame.font.SysFont("Arial", 15)
+# set up in main()
+Font = None
 
 size = (1024,1024)
 cellSize = 16
-screen = pygame.display.set_mode(size)
+screen = None
 
 def drawText(pos, text, color=(255,255,255), background=None):
   global Font
@@ -18,10 +19,16 @@ def drawText(pos, text, color=(255,255,255), background=None):
   else:
     label = Font.render(text, True, color)
 
-  screen.blit(label, pos)
+  return screen.blit(label, pos)
                         
-class GasCell:
+class GasCell(gasgrid.BaseCell):
+  __slots__ = ()
+  code = gasgrid.GAS
+  pressure = gasgrid.plane('pressure')
+  heat = gasgrid.plane('heat')
+
   def __init__(self):
+    gasgrid.BaseCell.__init__(self)
     self.heat = 0
     self.pressure = 0
 
@@ -34,16 +41,18 @@ class GasCell:
       p = 255
     return (p, p, 0)
 
-class HardCell:
-  def __init__(self):
-    pass
+class HardCell(gasgrid.BaseCell):
+  __slots__ = ()
+  code = gasgrid.HARD
+  stateless = True
 
   def getColor(self):
     return (0,255,0)
 
-class EmptyCell:
-  def __init__(self):
-    pass
+class EmptyCell(gasgrid.BaseCell):
+  __slots__ = ()
+  code = gasgrid.EMPTY
+  stateless = True
   
   def getColor(self):
     return (50,50,50)
@@ -52,118 +61,100 @@ class GasGroup:
   def __init__(self):
     self.sources = []
     self.dests = []
+    # membership, the lists above keep the order
+    self.sourceSet = set()
+    self.destSet = set()
    
   def addDest(self, dest, sources):
-    valid = False
-    for adest in self.dests:  
-      distx = adest[0] - dest[0]
-      disty = adest[1] - dest[1]
-      if ((abs(distx) <= 1) and (abs(disty) <= 1)):
-         valid = True
-
-    if (len(self.dests) == 0):
-      valid = True
+    valid = len(self.dests) == 0
+    for ix in range(-1,2):
+      for iy in range(-1,2):
+        if (dest[0] + ix, dest[1] + iy) in self.destSet:
+          valid = True
 
     if valid:
-      self.dests += [dest]
-      for source in sources:
-        if not source in self.sources:
-          self.sources += [source]
+      self.add(dest, sources)
       
     return valid
     #if (source in self.source):
 
+  def add(self, dest, sources):
+    self.dests += [dest]
+    self.destSet.add(dest)
+    for source in sources:
+      if not source in self.sourceSet:
+        self.sources += [source]
+        self.sourceSet.add(source)
+
   def containsDest(self, x, y):
-    return (x,y) in self.dests
+    return (x,y) in self.destSet
 
   def containsSource(self, x, y):
-    return (x,y) in self.sources
+    return (x,y) in self.sourceSet
 
       
-class GameGrid:
-  def __init__(self, w, h):
-    self.cells = [[EmptyCell() for x in range(w)] for y in range(h)]
-    self.updates = []
-    self.groups = []
-      
-  def __getitem__(self, key):
-    if (key[0] < 0):
-      return HardCell();
+def cellColor(code, heat, pressure):
+  cell = GameGrid.cellTypes[code]()
+  if code == gasgrid.GAS:
+    cell.pressure = pressure
+  return cell.getColor()
 
-    if (key[1] < 0):
-      return HardCell();
+# neighbors a gas cell spreads into, column by column
+SPREAD = [(ix, iy) for ix in range(-1,2) for iy in range(-1,2) if not (ix == 0 and iy == 0)]
 
-    if (key[0] >= len(self.cells)):
-      return HardCell();
+class GameGrid(gasgrid.GameGrid):
+  cellTypes = (EmptyCell, HardCell, GasCell)
+  cellSize = cellSize
+  # the yellow saturates outside of -258..254 pressure
+  palette = gasrender.Palette(cellColor, pressure=gasrender.clamped(-258, 254))
 
-    if (key[1] >= len(self.cells[0])):
-      return HardCell();
-
-      
-    return self.cells[key[1]][key[0]]
-
-  def __setitem__(self, key, value):
-    self.cells[key[1]][key[0]] = value
+  def __init__(self, w, h):
+    gasgrid.GameGrid.__init__(self, w, h)
+    self.updates = []
+    self.groups = []
+    # gas cells touching air, the only ones updateGas has to look at
+    self.trackFrontier(self.touchesAir)
+
+  def touchesAir(self, i):
+    if self.types[i] != gasgrid.GAS:
+      return False
+
+    x = i % self.w
+    y = i // self.w
+    for ix in range(-1,2):
+      for iy in range(-1,2):
+        if self.typeAt(x + ix, y + iy) == gasgrid.EMPTY:
+          return True
+    return False
     
-  def render(self, surface):
-    x = 0
-    y = 0
-    for row in self.cells:
-      x = 0
-      for cell in row:
-        surface.fill(cell.getColor(), (x * cellSize, y * cellSize, cellSize-1, cellSize-1))
-        x = x + 1
-      y = y + 1
       
   def updateGas(self):
     # Find all blocks we want to spread into
     updates = {}
-    x = 0
-    y = 0
-    for row in self.cells:
-      x = 0
-      for cell in row:
-        if isinstance(cell, GasCell) and cell.pressure > 0:
-          for ix in range(-1,2):
-            for iy in range(-1,2):
-              if not (ix == 0 and iy == 0):
-                xx = ix + x
-                yy = iy + y
-                if isinstance(self[xx, yy], EmptyCell):
-                  if not (xx, yy) in updates:
-                    updates[(xx, yy)] = []
-                    
-                  updates[(xx, yy)] += [(x,y)]
-
-        x = x + 1
-      y = y + 1
+    w = self.w
+    pressure = self.pressure
+    sources = [i for i in self.frontier.ordered() if pressure[i] > 0]
+    around = self.neighborsOf(sources, SPREAD)
+    n = len(SPREAD)
+    for k, i in enumerate(sources):
+      x = i % w
+      y = i // w
+      for d, (ix, iy) in enumerate(SPREAD):
+        if around[k * n + d] == gasgrid.EMPTY:
+          xx = ix + x
+          yy = iy + y
+          if not (xx, yy) in updates:
+            updates[(xx, yy)] = []
+            
+          updates[(xx, yy)] += [(x,y)]
       
     # Once we have these blocks we seperate them into groups, their source blocks 
     # contribute collectively to their expansion powers.
     groups = []
-    currentUpdate = updates.keys()
-
-    gasg = GasGroup()
-    while len(currentUpdate) > 0:
-      # this is a bit of a hack, forces a new GasGroup to only be created when we've
-      # exhauasted the list of available destinations, after iterating the list
-
-      createNewGroup = True
-
-      nextUpdate = []
-      for update in currentUpdate:
-        if not gasg.addDest(update, updates[update]):
-          nextUpdate += [update]
-        else:
-          createNewGroup = False
-
-      if createNewGroup:
-        groups += [gasg]
-        gasg = GasGroup()
-
-      currentUpdate = nextUpdate;
-    
-    if not gasg in groups:
+    for dests in gasgrid.components(updates.keys()):
+      gasg = GasGroup()
+      for dest in dests:
+        gasg.add(dest, updates[dest])
       groups += [gasg]
       
     #now that the groups have been determined...
@@ -212,18 +203,34 @@ class GameGrid:
           
         destCell.pressure += avgPressure
         
-      for i in range(remainPressure):
-        dest = random.choice(dest_sources.keys())
-        destCell = self[dest[0], dest[1]]
-        destCell.pressure += 1
+      # every dest belongs to one group, so its first one keys the draws
+      rng = self.random(self.index(*group.dests[0]))
+      keys = dest_sources.keys()
+      for dest, extra in zip(keys, rng.split(remainPressure, len(keys))):
+        if extra:
+          self[dest[0], dest[1]].pressure += extra
            
     self.groups = groups      
     self.updates = updates
+    self.tick += 1
   
 
   def renderFoam(self, surface):
+    rects = []
     for update in self.updates:
-      pygame.draw.rect(surface, (255,0,0), (update[0] * cellSize, update[1] * cellSize, cellSize, cellSize), 1)
+      rects += [pygame.draw.rect(surface, (255,0,0), (update[0] * cellSize, update[1] * cellSize, cellSize, cellSize), 1)]
+    return rects
+
+def addGas(gg, x, y, pressure=256):
+  """What a right click does, also used to seed headless runs"""
+  cell = GasCell()
+  gg[x,y] = cell
+  cell.pressure = pressure
+  cell.heat = 128
+  return cell
+
+def addHard(gg, x, y):
+  gg[x,y] = HardCell.shared()
 
 def processEvent(gg, event):
   global running
@@ -242,14 +249,11 @@ def processEvent(gg, event):
     cell = gg[x,y]
     if event.button == 1:
       if isinstance(cell, HardCell):
-        gg[x,y] = EmptyCell()
+        gg[x,y] = EmptyCell.shared()
       if isinstance(cell, EmptyCell):
-        gg[x,y] = HardCell()
+        gg[x,y] = HardCell.shared()
     elif event.button == 3:
-      cell = GasCell()
-      gg[x,y] = cell
-      cell.pressure = 256;
-      cell.heat = 128;
+      addGas(gg, x, y)
       
   #elif event.type == MOUSEBUTTONUP:
 
@@ -283,6 +287,7 @@ def updateData(gg):
     for source in gg.updates[(cellx, celly)]:
       messages += [str(source)]
 
+  rects = []
   if True:
     for group in gg.groups:
       if group.containsDest(cellx, celly):
@@ -290,32 +295,43 @@ def updateData(gg):
         messages += ["Sources: " + ",".join([str(source) for source in group.sources])]
         
         for dest in group.dests:
-          pygame.draw.rect(screen, (255,255,255), (dest[0] * cellSize, dest[1] * cellSize, cellSize, cellSize), 1)
+          rects += [pygame.draw.rect(screen, (255,255,255), (dest[0] * cellSize, dest[1] * cellSize, cellSize, cellSize), 1)]
           
         for source in group.sources:
-          screen.fill((0,0,255), (source[0] * cellSize, source[1] * cellSize, cellSize-1, cellSize-1))
+          rects += [screen.fill((0,0,255), (source[0] * cellSize, source[1] * cellSize, cellSize-1, cellSize-1))]
             
   y = 5
   for message in messages:
-    drawText((5,y), message)
+    rects += [drawText((5,y), message)]
     y = y + 20
+  return rects
 
 
 def main():
   global running
   global clock
+  global screen
+  global Font
+  pygame.init()
+  Font = pygame.font.SysFont("Arial", 15)
+  screen = pygame.display.set_mode(size)
+
   clock = pygame.time.Clock()
 
   gg = GameGrid(size[0]/cellSize, size[1]/cellSize)
+  # a different world every run, headless runs pick their seed
+  gg.reseed(random.getrandbits(32))
+  overlay = []
   while running:
     processEvents(gg)
-    screen.fill((0,0,0))
+    gg.uncover(screen, overlay)
 
-    gg.render(screen)
-    gg.renderFoam(screen)
-    updateData(gg)
+    rects = gg.render(screen)
+    overlay = gg.renderFoam(screen)
+    overlay += updateData(gg)
      
-    pygame.display.flip();
+    pygame.display.update(rects + overlay);
     clock.tick(60)
 
-main()
+if __name__ == "__main__":
+  main()
@@ -1,16 +1,23 @@
 #!/usr/bin/env python
 import random
 import pygame
+import gasclock
+import gaschunks
+import gasgrid
+import gasrender
 from pygame.locals import *
-pygame.init()
+# set up in main()
+Font = None
 
-Font = pygame.font.SysFont("Arial", 15)
-
-random.SystemRandom()
 
 size = (1280, 1280)
 cellSize = 8
-screen = pygame.display.set_mode(size)
+# the window redraws frameRate times a second, the gas moves ticksPerSecond
+# times a second (None: as fast as it can)
+frameRate = 30
+ticksPerSecond = 10
+ticker = None
+screen = None
 
 def drawText(pos, text, color=(255,255,255), background=None):
   global Font
@@ -20,55 +27,37 @@ def drawText(pos, text, color=(255,255,255), background=None):
   else:
     label = Font.render(text, True, color)
 
-  screen.blit(label, pos)
+  return screen.blit(label, pos)
                     
-class BaseCell:
-  def __init__(self, gameGrid = None):
-    self.gameGrid = gameGrid
-    self.x = 0
-    self.y = 0
-    
+class BaseCell(gasgrid.BaseCell):
+  __slots__ = ()
+
   def render(self, surface):
     surface.fill(self.getColor(), (self.x * cellSize, self.y * cellSize, cellSize-1, cellSize-1))
     
-  def getNeighbors(self):
-    if not self.gameGrid:
-      return []
-
-    return [
-      self.gameGrid[self.x - 1, self.y - 1],
-      self.gameGrid[self.x, self.y - 1],
-      self.gameGrid[self.x + 1, self.y - 1],
-      self.gameGrid[self.x - 1, self.y],
-      self.gameGrid[self.x + 1, self.y],
-      self.gameGrid[self.x - 1, self.y + 1],
-      self.gameGrid[self.x, self.y + 1],
-      self.gameGrid[self.x + 1, self.y + 1]
-    ]
-    
   def getDebug(self):
     return [
       "Cell: " + self.__class__.__name__,
       "   Air: " + str(len([n for n in self.getNeighbors() if isinstance(n, EmptyCell)]))
     ]
   
-  def update(self):
-    return False
-    
-  def replace(self, instance):
-    if self.gameGrid:
-      self.gameGrid[self.x, self.y] = instance
-      
-    return instance
-
 class AmberCell(BaseCell):
+  __slots__ = ()
+  code = gasgrid.AMBER
+  stateless = True
+
   def __init__(self, gameGrid=None):
-    pass
+    BaseCell.__init__(self, gameGrid)
     
   def getColor(self):
     return (255,255,0)
                           
 class GasCell(BaseCell):
+  __slots__ = ()
+  code = gasgrid.GAS
+  pressure = gasgrid.plane('pressure')
+  heat = gasgrid.plane('heat')
+
   def __init__(self, gameGrid=None):
     BaseCell.__init__(self, gameGrid)
     self.heat = 100
@@ -100,150 +89,180 @@ class GasCell(BaseCell):
     colp.hsva = (self.heat, 99, pres)
     return colp
     
-  def crystalize1(self):
-    """Checks the surrounding neighbors for impurities, anything other than gas"""
-    global foaming
-
-    neighbors = self.getNeighbors()
-    for n in neighbors:
-      if not isinstance(n, GasCell):
-        self.replace(AmberCell())
-        foaming = False
-        return
-        
-  def crystalize(self):
-    return
-    
-    neighbors = self.getNeighbors()
-    
-    for n in neighbors:
-      if isinstance(n, GasCell):
-        if n.crystalized or n.crystalization > 0:
-          self.crystalization = 1
-          return 
+  def share(self, rng, gasNeighbors, newNeighbors):
+    """Hand all our pressure out, one unit at a time to a random gas neighbor.
+
+    While that neighbor has no more pressure than we do the unit goes to a
+    random new neighbor instead.  Our pressure drops by one every unit, so
+    when each neighbor starts taking its units is known up front, and the
+    units in between are split in one draw each.  The neighbors are flat
+    indices into the planes.
+    """
+    gg = self.gameGrid
+    pressure = self.pressure
+    start = [gg.pressure[j] for j in gasNeighbors]
+    gains = [0] * len(gasNeighbors)
+    fresh = 0
+    while pressure > 0:
+      if len(newNeighbors) == 0:
+        low = 1
       else:
-        self.crystalization = 1
-        return 
-   
+        # the next neighbor to open up has the most pressure we still beat
+        low = max([s for s in start if s <= pressure] or [1])
+        low = max(low, 1)
+      steps = pressure - low + 1
+      counts = rng.split(steps, len(gasNeighbors))
+      for k in range(len(gasNeighbors)):
+        if len(newNeighbors) == 0 or pressure < start[k]:
+          gains[k] += counts[k]
+        else:
+          fresh += counts[k]
+      pressure -= steps
+
+    for j, gain in zip(gasNeighbors, gains):
+      gg.setPressure(j, gg.pressure[j] + gain)
+    if fresh:
+      for j, gain in zip(newNeighbors, rng.split(fresh, len(newNeighbors))):
+        gg.setPressure(j, gg.pressure[j] + gain)
+    self.pressure = 0
+
   def update(self):
     if self.heat > 10 and self.pressure > 0:
-      neighbors = self.getNeighbors()
+      gg = self.gameGrid
+      rng = gg.random(self.index)
+      neighbors = self.neighborIndices()
       #randomize this for fringe edges to not have an affinity!
-      random.shuffle(neighbors)
+      rng.shuffle(neighbors)
 
-      gasNeighbors = [n for n in neighbors if isinstance(n, GasCell)]
+      types = gg.types
+      gasNeighbors = [j for j in neighbors if j >= 0 and types[j] == gasgrid.GAS]
       
       # spread into all my air neighbors
       newNeighbors = []
-      for neighbor in neighbors:
+      for j in neighbors:
         if self.pressure > 0:
-          if isinstance(neighbor, EmptyCell):
-            newGas = GasCell()
+          if j >= 0 and types[j] == gasgrid.EMPTY:
             self.pressure -= 1
-            neighbor.replace(newGas)
-            newNeighbors += [newGas]
+            gg.place(j, gasgrid.GAS, 0, 100)
+            newNeighbors += [j]
         else:
           break                      
 
       # if I still have pressure spread into ALL gas cells around me
       if len(gasNeighbors) > 0:
-        while self.pressure > 0:
-          r = random.randint(0, len(gasNeighbors) - 1)
-          ncell = gasNeighbors[r]
-          if len(newNeighbors) == 0 or self.pressure < ncell.pressure:
-            ncell.pressure += 1
-            self.pressure -= 1
-          else:
-            random.choice(newNeighbors).pressure += 1
-            self.pressure -= 1
-      
-    if self.heat > 0:
-      self.heat -= 1
-    else:
-      self.crystalize()
+        self.share(rng, gasNeighbors, newNeighbors)
       
 
 class HardCell(BaseCell):
+  __slots__ = ()
+  code = gasgrid.HARD
+  stateless = True
+
   def getColor(self):
     return (0,255,0)
 
 class EmptyCell(BaseCell):
+  __slots__ = ()
+  code = gasgrid.EMPTY
+  stateless = True
+
   def getColor(self):
     return (50,50,50)
       
-class GameGrid:
+def idle(gg, i):
+  """Gas that can only cool down: no pressure, or too cold to push it anywhere"""
+  return gg.pressure[i] == 0 or gg.heatAt(i) <= 10
+
+def cellColor(code, heat, pressure):
+  cell = GameGrid.cellTypes[code]()
+  if code == gasgrid.GAS:
+    cell.heat = heat
+    cell.pressure = pressure
+  return cell.getColor()
+
+class GameGrid(gasgrid.GameGrid):
+  cellTypes = (EmptyCell, HardCell, GasCell, AmberCell)
+  cellSize = cellSize
+  # hue follows the heat, brightness stops changing at 5 pressure
+  palette = gasrender.Palette(cellColor, heat=gasrender.clamped(0, 100), pressure=gasrender.clamped(0, 5))
+
   def __init__(self, w, h):
-    self.w = w
-    self.h = h
+    gasgrid.GameGrid.__init__(self, w, h)
+    # worldData() reads the totals instead of walking the grid
+    self.trackTally()
+    # gas loses 1 heat a tick, worked out when it is read
+    self.trackCooling(1, events=True)
+    # gas that can do nothing but cool sleeps
+    self.trackRegions(idle=idle)
+    # cold gas with an impurity next to it, the crystalizing front
+    self.trackFrontier(self.crystalizes)
+
+  def crystalizes(self, i):
+    """Cold gas touching anything other than gas turns to amber"""
+    if self.types[i] != gasgrid.GAS or self.heatAt(i) > 0:
+      return False
+
+    x = i % self.w
+    y = i // self.w
+    for iy in range(-1, 2):
+      for ix in range(-1, 2):
+        if self.typeAt(x + ix, y + iy) != gasgrid.GAS:
+          return True
+    return False
 
-    self.cells = [[EmptyCell(self) for x in range(w)] for y in range(h)]
-    for y in range(h):
-      for x in range(w):
-        self[x,y] = EmptyCell(self)
-        
-  def clone(self):
-    gg = GameGrid(self.w, self.h)
-    gg.cells = [cell for cell in [row for row in self.cells]]
-    return gg
-
-  def __getitem__(self, key):
-    if (key[0] < 0):
-      return HardCell(None);
-
-    if (key[1] < 0):
-      return HardCell(None);
-
-    if (key[0] >= len(self.cells)):
-      return HardCell();
-
-    if (key[1] >= len(self.cells[0])):
-      return HardCell();
-
-    cell = self.cells[key[1]][key[0]]
-    cell.gameGrid = self
-    cell.x = key[0]
-    cell.y = key[1]
-    return cell
-
-  def __setitem__(self, key, value):
-    value.x = key[0]
-    value.y = key[1]
-    value.gameGrid = self
-    self.cells[key[1]][key[0]] = value
-    
-  def render(self, surface):
-    x = 0
-    y = 0
-    for row in self.cells:
-      x = 0
-      for cell in row:
-        cell.render(surface)
-        x = x + 1
-      y = y + 1
+  def renderCell(self, surface, cell):
+    cell.render(surface)
       
   def update(self):
-    gasCells = []
-    for row in self.cells:
-      for cell in row:
-        if isinstance(cell, GasCell):
-          gasCells += [cell]
-          
-    for gasCell in gasCells:
+    for gasCell in self.regions.cellsOf(gasgrid.GAS):
       gasCell.update()
+    # gas whose heat ran out this tick may have joined the front
+    for i in self.cooling.expire():
+      self.frontier.changed(i)
+    self.crystalize()
+    self.regions.rest()
+    self.tick += 1
+
+  def crystalize(self):
+    """Turn the front to amber.
+
+    Placing a cell queues it and its neighbors with the frontier, so the
+    cold gas next to new amber crystalizes on the next tick and nothing
+    away from the front is looked at.  The whole front turns at once,
+    against the grid as the expansion left it.
+    """
+    w = self.w
+    for i in self.frontier.ordered():
+      self[i % w, i // w] = AmberCell.shared()
          
   def worldData(self):
-    pressure = 0
-    volume = 0
-    for row in self.cells:
-      for cell in row:
-        if isinstance(cell, GasCell):
-          volume += 1
-          pressure += cell.pressure
-
-    return ["World Data: ",  "   pressure:" + str(pressure), "   volume: " + str(volume)]
+    self.settle()
+    pressure = self.pressureOf(gasgrid.GAS)
+    volume = self.countOf(gasgrid.GAS)
+
+    return ["World Data: ",  "   pressure:" + str(pressure), "   volume: " + str(volume),
+            "   heat: " + str(self.tally.heatRange())]
   
+class SparseGameGrid(gaschunks.SparseGrid, GameGrid):
+  """GameGrid keeping only the chunks with something in them"""
+
+def addGas(gg, x, y, pressure=256):
+  """What a right click does, also used to seed headless runs"""
+  cell = GasCell()
+  gg[x,y] = cell
+  cell.pressure = pressure
+  cell.heat = 100
+  return cell
+
+def addHard(gg, x, y):
+  gg[x,y] = HardCell.shared()
+
 foaming = True
 drawing = False
+# print every tick that changes the total pressure (gasgrid.GameGrid.conserving)
+debug = False
+# SparseGameGrid instead of GameGrid, for worlds mostly empty
+sparse = False
 
 def processEvent(gg, event):
   global running
@@ -260,6 +279,12 @@ def processEvent(gg, event):
       gg.update();
     if event.key == K_f:
       foaming = not foaming
+    if event.key == K_EQUALS:
+      ticker.faster()
+    if event.key == K_MINUS:
+      ticker.slower()
+    if event.key == K_0:
+      ticker.toggleFast()
           
   elif event.type == MOUSEBUTTONDOWN:
     x = event.pos[0]/cellSize
@@ -267,16 +292,12 @@ def processEvent(gg, event):
     cell = gg[x,y]
     if event.button == 1:
       if isinstance(cell, EmptyCell):
-        gg[x,y] = HardCell()
+        gg[x,y] = HardCell.shared()
       else:
-        gg[x,y] = EmptyCell()
+        gg[x,y] = EmptyCell.shared()
 
     elif event.button == 3:
-      cell = GasCell()
-      gg[x,y] = cell
-
-      cell.pressure = 256;
-      cell.heat = 100;
+      addGas(gg, x, y)
 
   #elif event.type == MOUSEBUTTONUP:
 
@@ -287,13 +308,19 @@ def processEvents(gg):
         
 running = True
 
+def step(gg):
+  if foaming and debug:
+    gg.conserving(gg.update)
+  elif foaming:
+    gg.update()
+
 def updateData(gg):
   global screen
   global clock
   global foaming
 
   messages = [
-    "FPS: " + str(int(clock.get_fps())) + (" Animating!" if foaming else "")
+    "FPS: " + str(int(clock.get_fps())) + " " + ticker.describe() + (" Animating!" if foaming else "")
   ] + gg.worldData()
 
 
@@ -307,32 +334,45 @@ def updateData(gg):
   messages += cell.getDebug()
 
   y = 5
+  rects = []
   for message in messages:
-    drawText((5,y), message)
+    rects += [drawText((5,y), message)]
     y = y + 20
+  return rects
 
 
 def main():
   global running
   global clock
+  global screen
+  global Font
   global foaming
+  global ticker
+  pygame.init()
+  Font = pygame.font.SysFont("Arial", 15)
+  screen = pygame.display.set_mode(size)
+
   clock = pygame.time.Clock()
 
-  gg = GameGrid(size[0]/cellSize, size[1]/cellSize)
+  gg = (SparseGameGrid if sparse else GameGrid)(size[0]/cellSize, size[1]/cellSize)
+  # a different world every run, headless runs pick their seed
+  gg.reseed(random.getrandbits(32))
+  ticker = gasclock.Ticker(lambda: step(gg), ticksPerSecond)
+  overlay = []
   while running:
     processEvents(gg)
-    screen.fill((0,0,0))
+    gg.uncover(screen, overlay)
 
-    gg.render(screen)
+    rects = gg.render(screen)
 
-    if foaming:
-      gg.update();
+    ticker.advance(foaming)
 
     #gg.renderFoam(screen)
-    updateData(gg)
+    overlay = updateData(gg)
     
      
-    pygame.display.flip();
-    clock.tick(10)
+    pygame.display.update(rects + overlay);
+    clock.tick(frameRate)
 
-main()
+if __name__ == "__main__":
+  main()
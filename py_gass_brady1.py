@@ -1,18 +1,18 @@
 #!/usr/bin/env python
+import array
 import pygame
-import copy
 import random
+import gasfile
+import gasgrid
+import gasrender
 from pygame.locals import *
-pygame.init()
-
-Font = pygame.font.SysFont("monospace", 15)
+# set up in main()
+Font = None
 
 size = (800, 800)
 cellSize = 8
-xmax = size[0]/cellSize
-ymax = size[1]/cellSize
 
-screen = pygame.display.set_mode(size)
+screen = None
 
 def drawText(pos, text, color=(255,255,255), background=None):
   global Font
@@ -21,10 +21,18 @@ def drawText(pos, text, color=(255,255,255), background=None):
     label = Font.render(text, True, color, background)
   else:
     label = Font.render(text, True, color)
-  screen.blit(label, pos)
+  return screen.blit(label, pos)
                         
-class GasCell:
-  def __init__(self,typ,pres):
+class GasCell(gasgrid.BaseCell):
+  # t is the type code (0 air, 1 hard, 2 gas, 3 foam), p the pressure
+  __slots__ = ('_types',)
+  t = gasgrid.plane('types')
+  p = gasgrid.plane('pressure')
+  code = property(lambda self: self.t)
+
+  # with no arguments a hard cell
+  def __init__(self,typ=gasgrid.HARD,pres=0):
+    gasgrid.BaseCell.__init__(self)
     self.t = typ
     self.p = pres
 
@@ -55,56 +63,58 @@ class EmptyCell:
 
 
 #gas-air interface
-def baif(x,y,arr):
-	if x < 1 or y < 1 or x > xmax-1 or y > ymax-1:
+def baif(x,y,t,w,h):
+	if x < 1 or y < 1 or x > h-2 or y > w-2:
 		return
-	if not arr[x][y].t == 2:
+	i = x*w + y
+	if not t[i] == 2:
 		return
-	if arr[x-1][y].t == 0:
+	if t[i-w] == 0:
 		return True
-	if arr[x+1][y].t == 0:
+	if t[i+w] == 0:
 		return True
-	if arr[x][y+1].t == 0:
+	if t[i+1] == 0:
 		return True
-	if arr[x][y-1].t == 0:
+	if t[i-1] == 0:
 		return True
 
 #Solid-gas interface
-def bgif(x,y,arr):
-	if x < 1 or y < 1 or x > xmax-1 or y > ymax-1:
+def bgif(x,y,t,w,h):
+	if x < 1 or y < 1 or x > h-2 or y > w-2:
 		return
-	if not arr[x][y].t == 2:
+	i = x*w + y
+	if not t[i] == 2:
 		return
-	if arr[x-1][y].t == 3:
+	if t[i-w] == 3:
 		return True
-	if arr[x+1][y].t == 3:
+	if t[i+w] == 3:
 		return True
-	if arr[x][y+1].t == 3:
+	if t[i+1] == 3:
 		return True
-	if arr[x][y-1].t == 3:
+	if t[i-1] == 3:
 		return True
 
-def ccfoam(x,y,arr,arrnew):
-	if x < 1 or y < 1 or x > xmax-1 or y > ymax-1:
+def ccfoam(x,y,t,p,tnew,pnew,rng,w,h):
+	if x < 1 or y < 1 or x > h-2 or y > w-2:
 		return
-	gv = arr[x][y].p
-	if not arr[x][y].t==2:
+	i = x*w + y
+	gv = p[i]
+	if not t[i]==2:
 		return
 	if gv < 2:
-		arrnew[x][y].t=3
-		#arr[x][y].t=3
+		tnew[i]=3
 		return
-	arrnew[x][y].p=arr[x][y].p+random.randint(gv/3,gv/2)
+	pnew[i]=p[i]+rng.randint(gv/3,gv/2)
 	validpos = []
 	#isfreeze=False
 	
-	if arr[x-1][y].t == 0 or arr[x-1][y].t == 2:
+	if t[i-w] == 0 or t[i-w] == 2:
 		validpos.append((x-1,y))
-	if arr[x+1][y].t == 0 or arr[x+1][y].t == 2:
+	if t[i+w] == 0 or t[i+w] == 2:
 		validpos.append((x+1,y))
-	if arr[x][y+1].t == 0 or arr[x][y+1].t == 2:
+	if t[i+1] == 0 or t[i+1] == 2:
 		validpos.append((x,y+1))
-	if arr[x][y-1].t == 0 or arr[x][y-1].t == 2:
+	if t[i-1] == 0 or t[i-1] == 2:
 		validpos.append((x,y-1))
 	
 	print validpos
@@ -112,76 +122,100 @@ def ccfoam(x,y,arr,arrnew):
 		return
 	dv = int((gv/len(validpos))*(len(validpos)/2))
 	for bl in validpos:
-		arrnew[bl[0]][bl[1]].p = arr[bl[0]][bl[1]].p + dv - random.randint(0,dv/4)
-		arrnew[bl[0]][bl[1]].t=2
+		j = bl[0]*w + bl[1]
+		pnew[j] = p[j] + dv - rng.randint(0,dv/4)
+		tnew[j]=2
 
 	
-def cycle(arr):
-	arrnew = copy.deepcopy(arr)
-	for x in range(len(arr)):
-		for y in range(len(arr[x])):
-			if(baif(x,y,arr)):
-				print "blockair if "+str((x,y))
-				ccfoam(x,y,arr,arrnew)
-			elif(bgif(x,y,arr)):
-				print "blockgas if "+str((x,y))
-				arrnew[x][y].t=3
-				#arr[x][y].t=3
-
-	arr = copy.deepcopy(arrnew)
-	return arr
-
-class GameGrid:
-  def __init__(self, w, h):
-    self.cells = [[GasCell(0,0) for x in range(w)] for y in range(h)]
-      
-  def __getitem__(self, key):
-    if (key[0] < 0):
-      return HardCell();
-
-    if (key[1] < 0):
-      return HardCell();
+def cycle(gg):
+	"""One foam step, reads the front planes and writes the back ones, then swaps them
+
+	Only the cells on the gas/air and gas/foam interfaces (gg.frontier) are
+	visited, in the same row order the full scan used.
+	"""
+	w, h = gg.w, gg.h
+	t, p = gg.types, gg.pressure
+	tnew, pnew = gg.backTypes, gg.backPressure
+	tnew[:] = t
+	gasgrid.copyPlane(pnew, p)
+	active = gg.frontier.ordered()
+	for i in active:
+		x = i / w
+		y = i % w
+		if(baif(x,y,t,w,h)):
+			print "blockair if "+str((x,y))
+			ccfoam(x,y,t,p,tnew,pnew,gg.random(i),w,h)
+		elif(bgif(x,y,t,w,h)):
+			print "blockgas if "+str((x,y))
+			tnew[i]=3
+
+	# ccfoam only writes a cell and its 4 neighbors
+	for i in active:
+		for j in (i, i-w, i+w, i-1, i+1):
+			if tnew[j] != t[j]:
+				gg.frontier.changed(j)
+				gg.markDirty((j,))
+			elif pnew[j] != p[j]:
+				gg.markDirty((j,))
+
+	gg.swap()
+	gg.tick += 1
+
+def interface(gg, i):
+	w, h = gg.w, gg.h
+	return baif(i / w, i % w, gg.types, w, h) or bgif(i / w, i % w, gg.types, w, h)
+
+def cellColor(code, heat, pressure):
+  return GasCell(code, pressure).getColor()
+
+class GameGrid(gasgrid.GameGrid):
+  cellTypes = (GasCell, GasCell, GasCell, GasCell)
+  cellSize = cellSize
+  # the hue wraps around every 8 * 360 pressure
+  palette = gasrender.Palette(cellColor, pressure=([v * 8 for v in range(360)], lambda p: p // 8 % 360))
 
-    if (key[0] >= len(self.cells)):
-      return HardCell();
-
-    if (key[1] >= len(self.cells[0])):
-      return HardCell();
-
-    return self.cells[key[1]][key[0]]
-  
-  def __setitem__(self, key, value):
-    self.cells[key[1]][key[0]] = value
+  def __init__(self, w, h):
+    gasgrid.GameGrid.__init__(self, w, h)
+    # the planes cycle() writes into, swapped with the front ones every step
+    self.backTypes = bytearray(self.types)
+    self.backPressure = array.array(gasgrid.PRESSURE, self.pressure)
+    self.trackFrontier(lambda i: interface(self, i))
+
+  def swap(self):
+    self.types, self.backTypes = self.backTypes, self.types
+    self.pressure, self.backPressure = self.backPressure, self.pressure
+    self.retally()
     
-  def render(self, surface):
-    x = 0
-    y = 0
-    for row in self.cells:
-      x = 0
-      for cell in row:
-        surface.fill(cell.getColor(), (x * cellSize, y * cellSize, cellSize-1, cellSize-1))
-        x = x + 1
-      y = y + 1
 
   def update(self):
-    self.cells = cycle(self.cells)
-    pass
+    cycle(self)
       
 def subdes(x,y,arr):
-	if x < 1 or y < 1 or x > xmax-1 or y > ymax-1:
+	if x < 1 or y < 1 or x > arr.w-1 or y > arr.h-1:
 		return
 	if arr[x,y].t==3:
 		arr[x,y].t=2
 		arr[x,y].p=(arr[x,y].p+5)*32
 
 def destroy(x,y,arr):
-	if x < 1 or y < 1 or x > xmax-1 or y > ymax-1:
+	if x < 1 or y < 1 or x > arr.w-1 or y > arr.h-1:
 		return
 	arr[x,y].t=0
 	for a in range(x-2,x+2):
 		for b in range(y-2,y+2):
 			subdes(a,b,arr)
 
+def addGas(gg, x, y, pressure=5000):
+  """What a right click does, also used to seed headless runs"""
+  gg[x,y] = GasCell(2,pressure)
+  return gg[x,y]
+
+def addHard(gg, x, y):
+  gg[x,y].t=1
+
+# s saves the world here and l loads it back
+worldFile = "py_gass_brady1.gas"
+
 def processEvent(gg, event):
   global running
   if event.type == QUIT:
@@ -197,7 +231,11 @@ def processEvent(gg, event):
       y = pygame.mouse.get_pos()[1]/cellSize
       destroy(x,y,gg)
     if event.key == K_r:
-      gg.cells = [[GasCell(0,0) for x in range(xmax)] for y in range(ymax)]
+      gg.clear()
+    if event.key == K_s:
+      gasfile.save(gg, worldFile)
+    if event.key == K_l:
+      gasfile.load(worldFile, gg)
   elif event.type == MOUSEBUTTONDOWN:
     x = event.pos[0]/cellSize
     y = event.pos[1]/cellSize
@@ -205,7 +243,7 @@ def processEvent(gg, event):
     if event.button == 1:
       gg[x,y].t=1
     elif event.button == 3:
-      gg[x,y] = GasCell(2,5000)
+      addGas(gg, x, y)
       
   #elif event.type == MOUSEBUTTONUP:
 
@@ -237,25 +275,37 @@ def updateData(gg):
 
   #draws messages            
   y = 5
+  rects = []
   for message in messages:
-    drawText((5,y), message)
+    rects += [drawText((5,y), message)]
     y = y + 20
+  return rects
 
 
 def main():
   global running
   global clock
+  global screen
+  global Font
+  pygame.init()
+  Font = pygame.font.SysFont("monospace", 15)
+  screen = pygame.display.set_mode(size)
+
   clock = pygame.time.Clock()
 
   gg = GameGrid(size[0]/cellSize, size[1]/cellSize)
+  # a different world every run, headless runs pick their seed
+  gg.reseed(random.getrandbits(32))
+  overlay = []
   while running:
     processEvents(gg)
-    screen.fill((0,0,0))
+    gg.uncover(screen, overlay)
 
-    gg.render(screen)
-    updateData(gg)
+    rects = gg.render(screen)
+    overlay = updateData(gg)
      
-    pygame.display.flip();
+    pygame.display.update(rects + overlay);
     clock.tick(60)
 
-main()
+if __name__ == "__main__":
+  main()
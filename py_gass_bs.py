@@ -1,13 +1,12 @@
 #!/usr/bin/env python
 import pygame
 from pygame.locals import *
-pygame.init()
-
-Font = pygame.font.SysFont("monospace", 15)
+# set up in main()
+Font = None
 
 size = (800, 800)
 cellSize = 8
-screen = pygame.display.set_mode(size)
+screen = None
 
 def drawText(pos, text, color=(255,255,255), background=None):
   global Font
@@ -140,6 +139,12 @@ def updateData(gg):
 def main():
   global running
   global clock
+  global screen
+  global Font
+  pygame.init()
+  Font = pygame.font.SysFont("monospace", 15)
+  screen = pygame.display.set_mode(size)
+
   clock = pygame.time.Clock()
 
   gg = GameGrid(size[0]/cellSize, size[1]/cellSize)
@@ -153,4 +158,5 @@ def main():
     pygame.display.flip();
     clock.tick(60)
 
-main()
+if __name__ == "__main__":
+  main()
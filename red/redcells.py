@@ -1,16 +1,25 @@
 #!/usr/bin/env python
+import os
+import sys
 import random
 import pygame
-from pygame.locals import *
-pygame.init()
 
-Font = pygame.font.SysFont("Tahoma", 15)
+# the grid storage lives with the gas experiments one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import gasgrid
+import gasrecord
+from pygame.locals import *
+# set up in main()
+Font = None
 
 random.SystemRandom()
 
+# record every frame here, for gasrecord.py to play back
+recordFile = None
+
 size = (1280, 1280)
 cellSize = 16
-screen = pygame.display.set_mode(size)
+screen = None
 
 def drawText(pos, text, color=(255,255,255), background=None):
   global Font
@@ -20,41 +29,20 @@ def drawText(pos, text, color=(255,255,255), background=None):
   else:
     label = Font.render(text, True, color)
 
-  screen.blit(label, pos)
+  return screen.blit(label, pos)
                     
-class BaseCell:
-  def __init__(self, gameGrid = None):
-    self.gameGrid = gameGrid
-    self.x = 0
-    self.y = 0
-    
+class BaseCell(gasgrid.BaseCell):
+  __slots__ = ()
+
   def render(self, surface):
     surface.fill(self.getColor(), (self.x * cellSize, self.y * cellSize, cellSize-1, cellSize-1))
     
-  def getNeighbors(self):
-    if not self.gameGrid:
-      return []
-
-    return [
-      self.gameGrid[self.x - 1, self.y - 1],
-      self.gameGrid[self.x, self.y - 1],
-      self.gameGrid[self.x + 1, self.y - 1],
-      self.gameGrid[self.x - 1, self.y],
-      self.gameGrid[self.x + 1, self.y],
-      self.gameGrid[self.x - 1, self.y + 1],
-      self.gameGrid[self.x, self.y + 1],
-      self.gameGrid[self.x + 1, self.y + 1]
-    ]
-    
   def getDebug(self):
     return [
       "Cell: " + self.__class__.__name__,
       "   Air: " + str(len([n for n in self.getNeighbors() if isinstance(n, EmptyCell)]))
     ]
   
-  def update(self):
-    return False
-
   def keyDown(self, key):
     pass
 
@@ -66,77 +54,36 @@ class BaseCell:
     
   def mouseUp(self, button):
     pass
-    
-  def replace(self, instance):
-    if self.gameGrid:
-      self.gameGrid[self.x, self.y] = instance
-      
-    return instance
 
 class HardCell(BaseCell):
+  __slots__ = ()
+  code = gasgrid.HARD
+  stateless = True
+
   def getColor(self):
     return (0,255,0)
 
   def mouseUp(self, button):
-    self.replace(EmptyCell())
+    self.replace(EmptyCell.shared())
 
 
 class EmptyCell(BaseCell):
+  __slots__ = ()
+  code = gasgrid.EMPTY
+  stateless = True
+
   def getColor(self):
     return (50,50,50)
 
   def mouseUp(self, button):
-    self.replace(HardCell())
+    self.replace(HardCell.shared())
       
-class GameGrid:
-  def __init__(self, w, h):
-    self.w = w
-    self.h = h
-
-    self.cells = [[EmptyCell(self) for x in range(w)] for y in range(h)]
-    for y in range(h):
-      for x in range(w):
-        self[x,y] = EmptyCell(self)
-        
-  def clone(self):
-    gg = GameGrid(self.w, self.h)
-    gg.cells = [cell for cell in [row for row in self.cells]]
-    return gg
-
-  def __getitem__(self, key):
-    if (key[0] < 0):
-      return HardCell(None);
-
-    if (key[1] < 0):
-      return HardCell(None);
-
-    if (key[0] >= len(self.cells)):
-      return HardCell();
-
-    if (key[1] >= len(self.cells[0])):
-      return HardCell();
-
-    cell = self.cells[key[1]][key[0]]
-    cell.gameGrid = self
-    cell.x = key[0]
-    cell.y = key[1]
-    return cell
-
-  def __setitem__(self, key, value):
-    value.x = key[0]
-    value.y = key[1]
-    value.gameGrid = self
-    self.cells[key[1]][key[0]] = value
-    
-  def render(self, surface):
-    x = 0
-    y = 0
-    for row in self.cells:
-      x = 0
-      for cell in row:
-        cell.render(surface)
-        x = x + 1
-      y = y + 1
+class GameGrid(gasgrid.GameGrid):
+  cellTypes = (EmptyCell, HardCell)
+  cellSize = cellSize
+
+  def renderCell(self, surface, cell):
+    cell.render(surface)
       
   def update(self):
     pass
@@ -202,31 +149,49 @@ def debugOverlay(gg):
   messages += cell.getDebug()
 
   y = 5
+  rects = []
   for message in messages:
-    drawText((5,y), message)
+    rects += [drawText((5,y), message)]
     y = y + 20
+  return rects
 
 def metaOverlay():
   global screen, size  
-  screen.fill((0,0,0), (size[0] - 32 - 10, 10, 32, 256))
+  return screen.fill((0,0,0), (size[0] - 32 - 10, 10, 32, 256))
 
 running = True
 def main():
   global running
   global clock
+  global screen
+  global Font
+  pygame.init()
+  Font = pygame.font.SysFont("Tahoma", 15)
+  screen = pygame.display.set_mode(size)
+
   clock = pygame.time.Clock()
 
   gg = GameGrid(size[0]/cellSize, size[1]/cellSize)
+  recorder = None
+  if recordFile and gasrecord.available():
+    recorder = gasrecord.Recorder(gg, recordFile)
+  overlay = []
   while running:
     processEvents(gg)
-    screen.fill((0,0,0))
+    gg.uncover(screen, overlay)
 
-    gg.render(screen)
+    rects = gg.render(screen)
     gg.update();
-    metaOverlay()
-    debugOverlay(gg)
+    if recorder:
+      recorder.record()
+    overlay = [metaOverlay()]
+    overlay += debugOverlay(gg)
      
-    pygame.display.flip();
+    pygame.display.update(rects + overlay);
     clock.tick(10)
 
-main()
+  if recorder:
+    recorder.close()
+
+if __name__ == "__main__":
+  main()
@@ -1,16 +1,29 @@
 #!/usr/bin/env python
 import random
 import pygame
+import gaschunks
+import gasclock
+import gasfile
+import gasgrid
+import gasprofile
+import gasrender
+import gaskernel
+import gasrecord
+import gastiles
+import gasworker
 from pygame.locals import *
-pygame.init()
+# set up in main()
+Font = None
 
-Font = pygame.font.SysFont("Arial", 15)
-
-random.SystemRandom()
 
 size = (1280, 1280)
 cellSize = 8
-screen = pygame.display.set_mode(size)
+# the window redraws frameRate times a second, the gas moves ticksPerSecond
+# times a second (None: as fast as it can)
+frameRate = 30
+ticksPerSecond = 10
+ticker = None
+screen = None
 
 def drawText(pos, text, color=(255,255,255), background=None):
   global Font
@@ -20,37 +33,17 @@ def drawText(pos, text, color=(255,255,255), background=None):
   else:
     label = Font.render(text, True, color)
 
-  screen.blit(label, pos)
+  return screen.blit(label, pos)
                     
-class BaseCell:
-  def __init__(self, gameGrid = None):
-    self.gameGrid = gameGrid
-    
-  def getNeighbors(self):
-    if not self.gameGrid:
-      return []
-
-    return [
-      self.gameGrid[self.x - 1, self.y - 1],
-      self.gameGrid[self.x, self.y - 1],
-      self.gameGrid[self.x + 1, self.y - 1],
-      self.gameGrid[self.x - 1, self.y],
-      self.gameGrid[self.x + 1, self.y],
-      self.gameGrid[self.x - 1, self.y + 1],
-      self.gameGrid[self.x, self.y + 1],
-      self.gameGrid[self.x + 1, self.y + 1]
-    ]
-
-  def update(self):
-    return False
-    
-  def replace(self, instance):
-    if self.gameGrid:
-      self.gameGrid[self.x, self.y] = instance
-      
-    return instance
+class BaseCell(gasgrid.BaseCell):
+  __slots__ = ()
                           
 class GasCell(BaseCell):
+  __slots__ = ()
+  code = gasgrid.GAS
+  pressure = gasgrid.plane('pressure')
+  heat = gasgrid.plane('heat')
+
   def __init__(self, gameGrid=None):
     BaseCell.__init__(self, gameGrid)
     self.heat = 100
@@ -91,19 +84,20 @@ class GasCell(BaseCell):
 
   def update(self):
     if self.pressure > 0:
+      gg = self.gameGrid
+      rng = gg.random(self.index)
       #randomize this for fringe edges to not have an affinity!
-      neighbors = self.getNeighbors()
-      random.shuffle(neighbors)
-      airNeighbors = [n for n in neighbors if isinstance(n, EmptyCell)]
+      neighbors = self.neighborIndices()
+      rng.shuffle(neighbors)
+      types = gg.types
+      airNeighbors = [j for j in neighbors if j >= 0 and types[j] == gasgrid.EMPTY]
 
       # spread into all my air neighbors
       if (len(airNeighbors)) > 0:
-        for n in airNeighbors:
+        for j in airNeighbors:
           if self.pressure > 0:
-            newGas = GasCell()
-            newGas.pressure = 1
             self.pressure -= 1
-            n.replace(newGas)
+            gg.place(j, gasgrid.GAS, 1, 100)
           else:
             break                      
 
@@ -116,131 +110,122 @@ class GasCell(BaseCell):
 
       # if I still have pressure spread into ALL gas cells around me
       if self.pressure > 0:
-          neighbors = self.getNeighbors()
-          gasNeighbors = [n for n in neighbors if isinstance(n, GasCell)]
+          neighbors = self.neighborIndices()
+          gasNeighbors = [j for j in neighbors if j >= 0 and types[j] == gasgrid.GAS]
 
-          while self.pressure > 0:
-            r = random.randint(0, len(gasNeighbors) - 1)
-            ncell = gasNeighbors[r]
-            ncell.pressure += 1
-            self.pressure -= 1
-            
-    if self.heat > 0:
-      self.heat -= 5
+          # every unit goes to a random one of them, all drawn in one go
+          if len(gasNeighbors) > 0:
+            shares = rng.split(self.pressure, len(gasNeighbors))
+            pressure = gg.pressure
+            for j, share in zip(gasNeighbors, shares):
+              gg.setPressure(j, pressure[j] + share)
+            self.pressure = 0
 
 class HardCell(BaseCell):
+  __slots__ = ()
+  code = gasgrid.HARD
+  stateless = True
+
   def getColor(self):
     return (0,255,0)
 
 class EmptyCell(BaseCell):
+  __slots__ = ()
+  code = gasgrid.EMPTY
+  stateless = True
+
   def getColor(self):
     return (50,50,50)
       
-class GameGrid:
+def cellColor(code, heat, pressure):
+  cell = GameGrid.cellTypes[code]()
+  if code == gasgrid.GAS:
+    cell.heat = heat
+    cell.pressure = pressure
+  return cell.getColor()
+
+class GameGrid(gasgrid.GameGrid):
+  cellTypes = (EmptyCell, HardCell, GasCell)
+  cellSize = cellSize
+  # hue follows the heat, brightness stops changing at 5 pressure
+  palette = gasrender.Palette(cellColor, heat=gasrender.clamped(0, 100), pressure=gasrender.clamped(0, 5))
+
   def __init__(self, w, h):
-    self.w = w
-    self.h = h
-    self.cells = [[EmptyCell(self) for x in range(w)] for y in range(h)]
+    gasgrid.GameGrid.__init__(self, w, h)
     self.updates = {}
     self.updating = False
-
-  def clone(self):
-    gg = GameGrid(self.w, self.h)
-    gg.cells = [cell for cell in [row for row in self.cells]]
-    return gg
-      
-  def __getitem__(self, key):
-    if (key[0] < 0):
-      return HardCell(None);
-
-    if (key[1] < 0):
-      return HardCell(None);
-
-    if (key[0] >= len(self.cells)):
-      return HardCell();
-
-    if (key[1] >= len(self.cells[0])):
-      return HardCell();
-
-    cell = self.cells[key[1]][key[0]]
-    cell.gameGrid = self
-    cell.x = key[0]
-    cell.y = key[1]
-    return cell
+    self.tiles = None
+    # worldData() reads the totals instead of walking the grid
+    self.trackTally()
+    # gas loses 5 heat a tick, worked out when it is read
+    self.trackCooling(5)
+    # gas with no pressure left sleeps
+    self.trackRegions()
 
   def __setitem__(self, key, value):
     if self.updating:
       self.updates[key] = value
     else:      
-      value.x = key[0]
-      value.y = key[1]
-      value.gameGrid = self
-      self.cells[key[1]][key[0]] = value
-    
-  def render(self, surface):
-    x = 0
-    y = 0
-    for row in self.cells:
-      x = 0
-      for cell in row:
-        surface.fill(cell.getColor(), (x * cellSize, y * cellSize, cellSize-1, cellSize-1))
-        x = x + 1
-      y = y + 1
+      gasgrid.GameGrid.__setitem__(self, key, value)
       
   def update(self):
-    gasCells = []
-    for row in self.cells:
-      for cell in row:
-        if isinstance(cell, GasCell):
-          gasCells += [cell]
-          
-    for gasCell in gasCells:
-      gasCell.update()
+    if vectorized and gaskernel.available() and self.dense:
+      # the kernels cool every cell themselves
+      self.cooling.pause()
+      # and step every gas cell, asleep or not
+      self.stepped(self.countOf(gasgrid.GAS))
+      if workers > 1:
+        if self.tiles is None:
+          self.tiles = gastiles.Tiles(self.w, self.h, workers)
+        self.tiles.step(self)
+      else:
+        gaskernel.spindlyStep(self)
+    else:
+      self.cooling.resume()
+      for gasCell in self.regions.cellsOf(gasgrid.GAS):
+        gasCell.update()
+      self.regions.rest()
+    self.tick += 1
 
   def updateGasOld(self):
     # Find all blocks we want to spread into
     sources = {}
     gas_sources = {}
-    x = 0
-    y = 0
-    for row in self.cells:
-      x = 0
-      for cell in row:
-        # cells with pressure
-        if isinstance(cell, GasCell):
-          #if (cell.heat < 50) and (cell.pressure > 0):
-          #  cell.pressure -= 1
-        
-          if cell.heat > 0 and not (x, y) in sources:
-            sources[(x, y)] = []
-
-          if cell.heat > 0 and not (x, y) in gas_sources:
-            gas_sources[(x, y)] = []
-
-
-          if cell.pressure > 0:
-            for ix in range(-1,2):
-              for iy in range(-1,2):
-                if not (ix == 0 and iy == 0):
-                  xx = ix + x
-                  yy = iy + y
-                  ncell = self[xx,yy]
+    for cell in self.cellsOf(gasgrid.GAS):
+      x = cell.x
+      y = cell.y
+      # cells with pressure
+      #if (cell.heat < 50) and (cell.pressure > 0):
+      #  cell.pressure -= 1
+    
+      if cell.heat > 0 and not (x, y) in sources:
+        sources[(x, y)] = []
+
+      if cell.heat > 0 and not (x, y) in gas_sources:
+        gas_sources[(x, y)] = []
+
+
+      if cell.pressure > 0:
+        for ix in range(-1,2):
+          for iy in range(-1,2):
+            if not (ix == 0 and iy == 0):
+              xx = ix + x
+              yy = iy + y
+              ncell = self[xx,yy]
+              
+              if isinstance(ncell, EmptyCell):
+                if not (xx, yy) in sources[x,y]:
+                  sources[x,y] += [(xx,yy)]
                   
-                  if isinstance(ncell, EmptyCell):
-                    if not (xx, yy) in sources[x,y]:
-                      sources[x,y] += [(xx,yy)]
-                      
-                  if isinstance(ncell, GasCell) and ncell.heat < 90:
-                    if not (xx, yy) in gas_sources[x,y]:
-                      gas_sources[x,y] += [(xx,yy)]
-
-          if cell.heat > 0:
-            cell.heat -= 5
-          #reduce heat in all existing blocks
-
-        x = x + 1
-      y = y + 1
+              if isinstance(ncell, GasCell) and ncell.heat < 90:
+                if not (xx, yy) in gas_sources[x,y]:
+                  gas_sources[x,y] += [(xx,yy)]
+
+      if cell.heat > 0:
+        cell.heat -= 5
+      #reduce heat in all existing blocks
       
+    rng = self.random(len(self.types))
     for source_pos in sources:
       source = self[source_pos[0], source_pos[1]]
       dests = sources[source_pos]
@@ -253,12 +238,11 @@ class GameGrid:
       if source.pressure > 0 and len(dests) > 0:
         source.pressure -= 1
         
-        pressure = source.pressure - random.randint(0,5)
+        pressure = source.pressure - rng.randint(0,5)
         source.pressure -= pressure
-        while pressure > 0:
-          pressure -= 1
-          adest = random.choice(dests)
-          self[adest[0], adest[1]].pressure += 1
+        if pressure > 0:
+          for adest, share in zip(dests, rng.split(pressure, len(dests))):
+            self[adest[0], adest[1]].pressure += share
 
     # interior gas pressures
     for source_pos in gas_sources:
@@ -272,26 +256,59 @@ class GameGrid:
       #   break;
       
       if source.pressure > 0 and len(dests) > 0:
-        adest = random.choice(dests)
+        adest = rng.choice(dests)
         self[adest[0], adest[1]].pressure += source.pressure
         source.pressure = 0
+    self.tick += 1
          
   def worldData(self):
-    pressure = 0
-    volume = 0
-    for row in self.cells:
-      for cell in row:
-        if isinstance(cell, GasCell):
-          volume += 1
-          pressure += cell.pressure
-
-    return {"pressure": pressure, "volume": volume}
+    self.settle()
+    pressure = self.pressureOf(gasgrid.GAS)
+    volume = self.countOf(gasgrid.GAS)
+
+    return {"pressure": pressure, "volume": volume, "heat": self.tally.heatRange()}
   
+class SparseGameGrid(gaschunks.SparseGrid, GameGrid):
+  """GameGrid keeping only the chunks with something in them"""
+
+def addGas(gg, x, y, pressure=10):
+  """What a right click does, also used to seed headless runs"""
+  cell = GasCell()
+  gg[x,y] = cell
+  cell.pressure = pressure
+  cell.heat = 100
+  return cell
+
+def addHard(gg, x, y):
+  gg[x,y] = HardCell.shared()
+
 foaming = False
 foaming_frame = 0
+# run the whole grid numpy kernel instead of GasCell.update (toggle with v)
+vectorized = False
+# worker processes for the vectorized kernel, more than one splits the grid in bands
+workers = 0
+# s saves the world here and l loads it back
+worldFile = "spindly.gas"
+# print every tick that changes the total pressure (gasgrid.GameGrid.conserving)
+debug = False
+# phase timings and counters in the overlay (toggle with p)
+profile = gasprofile.Profile()
+# record every tick here, for gasrecord.py to play back
+recordFile = None
+recorder = None
+# simulate in a separate process, the window only draws its frames (gasworker)
+threaded = False
+simulation = None
+# SparseGameGrid instead of GameGrid, for worlds mostly empty (the scalar update only)
+sparse = False
+
+# commands, as (KEY, key) or (CLICK, button, x, y)
+KEY = 1
+CLICK = 2
+
 def processEvent(gg, event):
   global running
-  global foaming
   
   if event.type == QUIT:
     running = False
@@ -299,28 +316,57 @@ def processEvent(gg, event):
   elif event.type == KEYDOWN:
     if event.key == K_ESCAPE:
       running = False
-    if event.key == K_SPACE:
-      gg.update();
-    if event.key == K_f:
-      foaming = not foaming
+    elif event.key == K_p:
+      profile.toggle()
+    else:
+      command(gg, KEY, event.key)
           
   elif event.type == MOUSEBUTTONDOWN:
-    x = event.pos[0]/cellSize
-    y = event.pos[1]/cellSize
+    command(gg, CLICK, event.button, event.pos[0]/cellSize, event.pos[1]/cellSize)
+
+  #elif event.type == MOUSEBUTTONUP:
+
+def command(gg, *args):
+  """Carry out a command, or pass it to the simulation process when there is one"""
+  if simulation is None:
+    applyCommand(gg, *args)
+  else:
+    simulation.send(*args)
+    # keep the flags the overlay shows in step
+    if args[0] == KEY and args[1] in (K_f, K_v):
+      applyCommand(gg, *args)
+
+def applyCommand(gg, kind, code, x=0, y=0):
+  global foaming
+  global vectorized
+
+  if kind == KEY:
+    if code == K_SPACE:
+      gg.update();
+    if code == K_f:
+      foaming = not foaming
+    if code == K_EQUALS:
+      ticker.faster()
+    if code == K_MINUS:
+      ticker.slower()
+    if code == K_0:
+      ticker.toggleFast()
+    if code == K_v:
+      vectorized = not vectorized
+    if code == K_s and gg.dense:
+      gasfile.save(gg, worldFile)
+    if code == K_l and gg.dense:
+      gasfile.load(worldFile, gg)
+
+  elif kind == CLICK:
     cell = gg[x,y]
-    if event.button == 1:
+    if code == 1:
       if isinstance(cell, HardCell):
-        gg[x,y] = EmptyCell()
+        gg[x,y] = EmptyCell.shared()
       if isinstance(cell, EmptyCell):
-        gg[x,y] = HardCell()
-    elif event.button == 3:
-      cell = GasCell()
-      gg[x,y] = cell
-
-      cell.pressure = 10;
-      cell.heat = 100;
-
-  #elif event.type == MOUSEBUTTONUP:
+        gg[x,y] = HardCell.shared()
+    elif code == 3:
+      addGas(gg, x, y)
 
 
 def processEvents(gg):
@@ -329,6 +375,14 @@ def processEvents(gg):
         
 running = True
 
+def step(gg):
+  if debug:
+    profile.run('tick', gg.conserving, gg.update)
+  else:
+    profile.run('tick', gg.update)
+  if recorder:
+    recorder.record()
+
 def updateData(gg):
   global screen
   global clock
@@ -345,41 +399,81 @@ def updateData(gg):
     infoStr += " Heat: " + str(cell.heat)
   
   messages = [
-    "FPS: " + str(int(clock.get_fps())) + (" Animating!" if foaming else ""),
+    "FPS: " + str(int(clock.get_fps())) + " " + (simulation or ticker).describe() + (" Animating!" if foaming else "") + (" Vectorized" if vectorized else ""),
     "Cell: " + cell.__class__.__name__ + " " + infoStr,
     "Air: " + str(len([n for n in cell.getNeighbors() if isinstance(n, EmptyCell)]))
-  ]
+  ] + profile.describe()
 
   #if (cellx, celly) in gg.updates:
   #  messages += ["Gas Sources"]
 
   y = 5
+  rects = []
   for message in messages:
-    drawText((5,y), message)
+    rects += [drawText((5,y), message)]
     y = y + 20
+  return rects
 
 
 def main():
   global running
   global clock
+  global screen
+  global Font
   global foaming
+  global ticker
+  global simulation
+  global recorder
+  pygame.init()
+  Font = pygame.font.SysFont("Arial", 15)
+  screen = pygame.display.set_mode(size)
+
   clock = pygame.time.Clock()
 
-  gg = GameGrid(size[0]/cellSize, size[1]/cellSize)
+  gg = (SparseGameGrid if sparse else GameGrid)(size[0]/cellSize, size[1]/cellSize)
+  # a different world every run, headless runs pick their seed
+  gg.reseed(random.getrandbits(32))
+  if recordFile and gasrecord.available() and gg.dense:
+    recorder = gasrecord.Recorder(gg, recordFile)
+  profile.instrument(gg)
+  ticker = gasclock.Ticker(lambda: step(gg), ticksPerSecond)
+  if threaded and gg.dense:
+    simulation = gasworker.Simulation(gg, applyCommand, lambda: ticker.advance(foaming))
+  try:
+    loop(gg)
+  finally:
+    if simulation:
+      simulation.close()
+    if recorder:
+      recorder.close()
+
+def loop(gg):
+  overlay = []
   while running:
-    processEvents(gg)
-    screen.fill((0,0,0))
-
-    gg.render(screen)
-
-    if foaming:
-      gg.update();
+    profile.run('events', processEvents, gg)
+    gg.uncover(screen, overlay)
+
+    if simulation:
+      frame = simulation.view(gg)
+      # the planes change under the grid, nothing is marked dirty
+      gg.invalidate()
+      profile.count('rendered', gg.pendingCells())
+      rects = profile.run('render', gg.render, screen)
+      if not simulation.frames.intact(frame):
+        simulation.view(gg)
+        rects = gg.render(screen)
+    else:
+      profile.count('rendered', gg.pendingCells())
+      rects = profile.run('render', gg.render, screen)
+      profile.run('update', ticker.advance, foaming)
 
     #gg.renderFoam(screen)
-    updateData(gg)
+    overlay = profile.run('overlay', updateData, gg)
     
      
-    pygame.display.flip();
-    clock.tick(10)
+    profile.run('display', pygame.display.update, rects + overlay)
+    profile.frame()
+    clock.tick(frameRate)
 
-main()
+if __name__ == "__main__":
+  main()